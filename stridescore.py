@@ -1,1304 +1,1914 @@
-import re
-import sqlite3
-import datetime
-import math
-import logging
-from typing import Optional, Tuple, Dict, Any, List
-import trueskill
-import argparse
-
-
-# -------------------------------------------------------------------------------------
-# Configuration and Global Constants
-# -------------------------------------------------------------------------------------
-DEFAULT_MU = 1000
-DEFAULT_SIGMA = 333.333
-MAX_DECAY = 0.50
-MIN_DAYS_NO_DECAY = 28
-MAX_DAYS_DECAY = 365
-
-# Weights for combined rating calculation
-HORSE_WEIGHT = 0.8
-DRIVER_WEIGHT = 0.1
-TRAINER_WEIGHT = 0.1
-
-# Flag for dry run (set by command line arg)
-DRY_RUN = False
-
-# Precompiled regex patterns for performance
-RE_DT_FORMATS = [
-    "%Y-%m-%d %H:%M:%S.%f",
-    "%Y-%m-%d %H:%M:%S",
-    "%Y-%m-%d %H:%M"
-]
-RE_ODDS = re.compile(r'^\*?\d+\.\d{2}$')
-RE_FINISH_DIGITS = re.compile(r'^(\d+)')
-RE_HEADER = re.compile(r'HN\s+(Horse|horsa)\s+PP', re.IGNORECASE)
-
-
-# -------------------------------------------------------------------------------------
-# Logging Configuration
-# -------------------------------------------------------------------------------------
-logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
-
-
-# -------------------------------------------------------------------------------------
-# Database Functions Module
-# -------------------------------------------------------------------------------------
-def init_db(db_name: str) -> None:
-    """
-    Create a database and tables if they do not exist.
-    Now includes tables for drivers and trainers alongside horses.
-    """
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        
-        # Original horse tables
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS player_ratings (
-                player_name TEXT PRIMARY KEY,
-                mu REAL,
-                sigma REAL,
-                last_played DATETIME,
-                last_track TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS horse_history (
-                player_name TEXT,
-                mu REAL,
-                sigma REAL,
-                race_date DATETIME,
-                last_track TEXT,
-                finish_position TEXT,
-                race_class TEXT,
-                FOREIGN KEY(player_name) REFERENCES player_ratings(player_name)
-            )
-        ''')
-        
-        # New tables for drivers
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS driver_ratings (
-                driver_name TEXT PRIMARY KEY,
-                mu REAL,
-                sigma REAL,
-                last_raced DATETIME,
-                last_track TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS driver_history (
-                driver_name TEXT,
-                mu REAL,
-                sigma REAL,
-                race_date DATETIME,
-                last_track TEXT,
-                horse_name TEXT,
-                finish_position TEXT,
-                race_class TEXT,
-                FOREIGN KEY(driver_name) REFERENCES driver_ratings(driver_name)
-            )
-        ''')
-        
-        # New tables for trainers
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS trainer_ratings (
-                trainer_name TEXT PRIMARY KEY,
-                mu REAL,
-                sigma REAL,
-                last_raced DATETIME,
-                last_track TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS trainer_history (
-                trainer_name TEXT,
-                mu REAL,
-                sigma REAL,
-                race_date DATETIME,
-                last_track TEXT,
-                horse_name TEXT,
-                finish_position TEXT,
-                race_class TEXT,
-                FOREIGN KEY(trainer_name) REFERENCES trainer_ratings(trainer_name)
-            )
-        ''')
-        
-        # Table to store complete race entry information
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS race_entries (
-                race_date DATETIME,
-                track TEXT,
-                race_number INTEGER,
-                horse_name TEXT,
-                driver_name TEXT,
-                trainer_name TEXT,
-                finish_position TEXT,
-                race_class TEXT,
-                gait TEXT,
-                is_qualifier BOOLEAN,
-                PRIMARY KEY(race_date, track, race_number, horse_name)
-            )
-        ''')
-        
-        conn.commit()
-    
-    # Ensure columns exist after potential creation
-    add_missing_columns(db_name)
-    add_indexes(db_name)
-
-
-def add_missing_columns(db_name: str) -> None:
-    """
-    Ensure that all tables have the required columns.
-    """
-    with sqlite3.connect(f"{db_name}.db") as conn:
-        cursor = conn.cursor()
-
-        # Check player_ratings
-        cursor.execute("PRAGMA table_info(player_ratings)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "last_track" not in columns:
-            logging.info(f"Adding last_track column to player_ratings in {db_name}.db")
-            cursor.execute("ALTER TABLE player_ratings ADD COLUMN last_track TEXT")
-
-        # Check horse_history
-        cursor.execute("PRAGMA table_info(horse_history)")
-        columns = [row[1] for row in cursor.fetchall()]
-        if "last_track" not in columns:
-            logging.info(f"Adding last_track column to horse_history in {db_name}.db")
-            cursor.execute("ALTER TABLE horse_history ADD COLUMN last_track TEXT")
-        
-        if "finish_position" not in columns:
-            logging.info(f"Adding finish_position column to horse_history in {db_name}.db")
-            cursor.execute("ALTER TABLE horse_history ADD COLUMN finish_position TEXT")
-
-        if "race_class" not in columns:
-            logging.info(f"Adding race_class column to horse_history in {db_name}.db")
-            cursor.execute("ALTER TABLE horse_history ADD COLUMN race_class TEXT")
-
-        conn.commit()
-
-
-def add_indexes(db_name: str) -> None:
-    """Add indexes to improve query performance."""
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        
-        # Add indexes for player/horse lookups
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_player_name ON player_ratings (player_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_horse_history_name ON horse_history (player_name)')
-        
-        # Add indexes for driver lookups
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_name ON driver_ratings (driver_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_history_name ON driver_history (driver_name)')
-        
-        # Add indexes for trainer lookups
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trainer_name ON trainer_ratings (trainer_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_trainer_history_name ON trainer_history (trainer_name)')
-        
-        # Add indexes for race entries
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_race_entries_horse ON race_entries (horse_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_race_entries_driver ON race_entries (driver_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_race_entries_trainer ON race_entries (trainer_name)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_race_entries_date ON race_entries (race_date)')
-        
-        conn.commit()
-
-
-def add_horse(db_name: str, player_name: str, race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None) -> None:
-    """
-    Add a new horse with default Mu, Sigma, and set last_played (date) and last_track (track name).
-    """
-    if DRY_RUN:
-        logging.info(f"DRY RUN: Would add horse '{player_name}' to {db_name}.db")
-        return
-        
-    race_date_val = race_date if race_date else datetime.datetime.now()
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR IGNORE INTO player_ratings (player_name, mu, sigma, last_played, last_track)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (player_name, DEFAULT_MU, DEFAULT_SIGMA, race_date_val, race_track))
-        conn.commit()
-
-
-def add_person(db_name: str, person_name: str, person_type: str, race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None) -> None:
-    """
-    Add a new driver or trainer with default Mu, Sigma.
-    person_type should be either "driver" or "trainer"
-    """
-    if DRY_RUN:
-        logging.info(f"DRY RUN: Would add {person_type} '{person_name}' to {db_name}.db")
-        return
-        
-    table_name = f"{person_type}_ratings"
-    date_field = "last_raced"
-    name_field = f"{person_type}_name"
-    
-    race_date_val = race_date if race_date else datetime.datetime.now()
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        query = f'''
-            INSERT OR IGNORE INTO {table_name} ({name_field}, mu, sigma, {date_field}, last_track)
-            VALUES (?, ?, ?, ?, ?)
-        '''
-        cursor.execute(query, (person_name, DEFAULT_MU, DEFAULT_SIGMA, race_date_val, race_track))
-        conn.commit()
-
-
-def get_player_rating(db_name: str, player_name: str, race_date: Optional[datetime.datetime] = None
-                     ) -> Tuple[Optional[trueskill.Rating], Optional[str]]:
-    """
-    Fetch a horse's current rating and last_played date from the DB.
-    Applies log-based decay if a last_played timestamp exists.
-    """
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('SELECT mu, sigma, last_played FROM player_ratings WHERE player_name=?', (player_name,))
-        result = cursor.fetchone()
-
-    if result:
-        mu, sigma, last_played_str = result
-        rating = trueskill.Rating(mu=mu, sigma=sigma)
-        if last_played_str:
-            last_played_dt = None
-            for fmt in RE_DT_FORMATS:
-                try:
-                    last_played_dt = datetime.datetime.strptime(last_played_str, fmt)
-                    break
-                except ValueError:
-                     continue
-            if last_played_dt is None:
-                logging.error(f"Time data {last_played_str!r} for player {player_name} does not match any expected format. Skipping decay.")
-                return rating, last_played_str
-
-            current_dt = race_date if race_date else datetime.datetime.now()
-            days_since_last = (current_dt - last_played_dt).days
-            decayed_mu = calculate_rating_decay(rating.mu, days_since_last)
-            rating = trueskill.Rating(mu=decayed_mu, sigma=rating.sigma)
-        return rating, last_played_str
-    else:
-        return None, None
-
-
-def get_person_rating(db_name: str, person_name: str, person_type: str, race_date: Optional[datetime.datetime] = None
-                     ) -> Optional[trueskill.Rating]:
-    """
-    Fetch a driver's or trainer's rating and apply decay.
-    person_type should be either "driver" or "trainer"
-    """
-    if not person_name:
-        return None
-        
-    table_name = f"{person_type}_ratings"
-    date_field = "last_raced"
-    name_field = f"{person_type}_name"
-    
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        query = f'SELECT mu, sigma, {date_field} FROM {table_name} WHERE {name_field}=?'
-        cursor.execute(query, (person_name,))
-        result = cursor.fetchone()
-    
-    if result:
-        mu, sigma, last_played_str = result
-        rating = trueskill.Rating(mu=mu, sigma=sigma)
-        
-        # Apply decay if we have a last played date
-        if last_played_str:
-            last_played_dt = None
-            for fmt in RE_DT_FORMATS:
-                try:
-                    last_played_dt = datetime.datetime.strptime(last_played_str, fmt)
-                    break
-                except ValueError:
-                     continue
-            
-            if last_played_dt is None:
-                logging.error(f"Time data {last_played_str!r} for {person_type} {person_name} does not match any expected format. Skipping decay.")
-                return rating
-                
-            current_dt = race_date if race_date else datetime.datetime.now()
-            days_since_last = (current_dt - last_played_dt).days
-            decayed_mu = calculate_rating_decay(rating.mu, days_since_last)
-            rating = trueskill.Rating(mu=decayed_mu, sigma=rating.sigma)
-            
-        return rating
-    else:
-        return None
-
-
-def update_player_rating(db_name: str, player_name: str, new_rating: trueskill.Rating,
-                         race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None) -> None:
-    """
-    Store the updated rating (Mu, Sigma), last_played (date), and last_track (track name)
-    in the player_ratings table.
-    """
-    if DRY_RUN:
-        logging.info(f"DRY RUN: Would update horse '{player_name}' in {db_name}.db to mu={new_rating.mu:.2f}, sigma={new_rating.sigma:.2f}")
-        return
-        
-    last_played_date = race_date if race_date else datetime.datetime.now()
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE player_ratings
-            SET mu = ?, sigma = ?, last_played = ?, last_track = ?
-            WHERE player_name = ?
-        ''', (new_rating.mu, new_rating.sigma, last_played_date, race_track, player_name))
-        conn.commit()
-
-
-def update_person_rating(db_name: str, person_name: str, person_type: str, new_rating: trueskill.Rating,
-                        race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None) -> None:
-    """
-    Store the updated rating for a driver or trainer.
-    person_type should be either "driver" or "trainer"
-    """
-    if DRY_RUN:
-        logging.info(f"DRY RUN: Would update {person_type} '{person_name}' in {db_name}.db to mu={new_rating.mu:.2f}, sigma={new_rating.sigma:.2f}")
-        return
-        
-    table_name = f"{person_type}_ratings"
-    date_field = "last_raced"
-    name_field = f"{person_type}_name"
-    
-    race_date_val = race_date if race_date else datetime.datetime.now()
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        query = f'''
-            UPDATE {table_name}
-            SET mu = ?, sigma = ?, {date_field} = ?, last_track = ?
-            WHERE {name_field} = ?
-        '''
-        cursor.execute(query, (new_rating.mu, new_rating.sigma, race_date_val, race_track, person_name))
-        conn.commit()
-
-
-def log_horse_race(db_name: str, player_name: str, mu: float, sigma: float,
-                   race_date: Optional[datetime.datetime] = None,
-                   race_track: Optional[str] = None,
-                   finish_position: Optional[str] = None,
-                   race_class: Optional[str] = None) -> None:
-    """Log a horse's race result to the history table."""
-    if DRY_RUN:
-        return
-        
-    race_date_val = race_date if race_date else datetime.datetime.now()
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO horse_history (player_name, mu, sigma, race_date, last_track, finish_position, race_class)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (player_name, mu, sigma, race_date_val, race_track, finish_position, race_class))
-        conn.commit()
-
-
-def log_person_race(db_name: str, person_name: str, person_type: str, mu: float, sigma: float,
-                   race_date: Optional[datetime.datetime] = None,
-                   race_track: Optional[str] = None,
-                   horse_name: Optional[str] = None,
-                   finish_position: Optional[str] = None,
-                   race_class: Optional[str] = None) -> None:
-    """
-    Log a driver's or trainer's race result to the history table.
-    person_type should be either "driver" or "trainer"
-    """
-    if DRY_RUN:
-        return
-        
-    table_name = f"{person_type}_history"
-    name_field = f"{person_type}_name"
-    
-    race_date_val = race_date if race_date else datetime.datetime.now()
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        query = f'''
-            INSERT INTO {table_name} 
-            ({name_field}, mu, sigma, race_date, last_track, horse_name, finish_position, race_class)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        '''
-        cursor.execute(query, (person_name, mu, sigma, race_date_val, race_track, 
-                               horse_name, finish_position, race_class))
-        conn.commit()
-
-
-def store_race_entry(db_name: str, race_date: datetime.datetime, track: str, race_number: int,
-                    horse_name: str, driver_name: Optional[str], trainer_name: Optional[str],
-                    finish_position: Optional[str], race_class: Optional[str],
-                    gait: str, is_qualifier: bool) -> None:
-    """
-    Store complete race entry information.
-    """
-    if DRY_RUN:
-        return
-        
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO race_entries
-            (race_date, track, race_number, horse_name, driver_name, trainer_name, 
-             finish_position, race_class, gait, is_qualifier)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (race_date, track, race_number, horse_name, driver_name, trainer_name, 
-              finish_position, race_class, gait, is_qualifier))
-        conn.commit()
-
-
-def calculate_rating_decay(mu: float, days_since_last_played: int) -> float:
-     """
-     Apply a log-based decay to a rating value.
-     - No decay if <= MIN_DAYS_NO_DECAY days.
-     - Gradually decays up to MAX_DECAY at MAX_DAYS_DECAY days.
-     """
-     if days_since_last_played <= MIN_DAYS_NO_DECAY:
-         return mu
-     # Cap decay days at MAX_DAYS_DECAY
-     if days_since_last_played > MAX_DAYS_DECAY:
-         days_since_last_played = MAX_DAYS_DECAY
-
-     # Ensure x is at least 1 for log calculation
-     x = max(1, (days_since_last_played - MIN_DAYS_NO_DECAY) + 1)
-     max_x = (MAX_DAYS_DECAY - MIN_DAYS_NO_DECAY) + 1
-     # Basic check to prevent division by zero or log(1) issues if MAX_DAYS_DECAY == MIN_DAYS_NO_DECAY
-     if max_x <= 1:
-        return mu # Or apply full decay, depending on desired logic for this edge case
-
-     ratio = math.log(x) / math.log(max_x)
-     decayed_mu = mu * (1 - ratio * MAX_DECAY)
-     return decayed_mu
-
-
-def fetch_and_decay_rating(db_name: str, player_name: str,
-                           race_date: Optional[datetime.datetime] = None,
-                           race_track: Optional[str] = None) -> trueskill.Rating:
-    """
-    Retrieve a horse's rating, apply decay if needed, and return the decayed rating.
-    If the horse doesn't exist, add it with a default rating, including the track.
-    """
-    rating, _ = get_player_rating(db_name, player_name, race_date)
-    if rating is None:
-        add_horse(db_name, player_name, race_date, race_track)
-        rating = trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
-    return rating
-
-
-def fetch_and_decay_person_rating(db_name: str, person_name: str, person_type: str,
-                                 race_date: Optional[datetime.datetime] = None,
-                                 race_track: Optional[str] = None) -> trueskill.Rating:
-    """
-    Retrieve a driver or trainer rating, apply decay if needed.
-    If the person doesn't exist, add them with a default rating.
-    person_type should be either "driver" or "trainer"
-    """
-    if not person_name:
-        return trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
-        
-    rating = get_person_rating(db_name, person_name, person_type, race_date)
-    if rating is None:
-        add_person(db_name, person_name, person_type, race_date, race_track)
-        rating = trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
-    return rating
-
-
-def calculate_adaptive_weights(has_driver: bool, has_trainer: bool) -> Dict[str, float]:
-    """
-    Calculate adaptive weights for horse, driver, and trainer
-    based on what data is available.
-    """
-    if has_driver and has_trainer:
-        # Complete data
-        return {
-            "horse": HORSE_WEIGHT,
-            "driver": DRIVER_WEIGHT,
-            "trainer": TRAINER_WEIGHT
-        }
-    elif has_driver and not has_trainer:
-        # No trainer data
-        return {
-            "horse": 0.7,
-            "driver": 0.3,
-            "trainer": 0.0
-        }
-    elif has_trainer and not has_driver:
-        # No driver data
-        return {
-            "horse": 0.8,
-            "driver": 0.0,
-            "trainer": 0.2
-        }
-    else:
-        # Only horse data
-        return {
-            "horse": 1.0,
-            "driver": 0.0,
-            "trainer": 0.0
-        }
-
-
-def get_combined_rating(db_name: str, horse_name: str, driver_name: Optional[str], trainer_name: Optional[str], 
-                        race_date: Optional[datetime.datetime] = None) -> trueskill.Rating:
-    """
-    Calculate a combined rating based on horse, driver, and trainer ratings.
-    Applies weighted average to mu and sigma values.
-    """
-    # Get individual ratings
-    horse_rating, _ = get_player_rating(db_name, horse_name, race_date)
-    if horse_rating is None:
-        horse_rating = trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
-    
-    driver_rating = None
-    if driver_name:
-        driver_rating = get_person_rating(db_name, driver_name, "driver", race_date)
-    if driver_rating is None:
-        driver_rating = trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
-    
-    trainer_rating = None
-    if trainer_name:
-        trainer_rating = get_person_rating(db_name, trainer_name, "trainer", race_date)
-    if trainer_rating is None:
-        trainer_rating = trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
-    
-    # Get adaptive weights based on available data
-    weights = calculate_adaptive_weights(driver_name is not None, trainer_name is not None)
-    
-    # Calculate weighted mu and sigma
-    combined_mu = (horse_rating.mu * weights["horse"] + 
-                   driver_rating.mu * weights["driver"] + 
-                   trainer_rating.mu * weights["trainer"])
-    
-    # For sigma, we use a weighted average of the sigmas
-    combined_sigma = (horse_rating.sigma * weights["horse"] + 
-                      driver_rating.sigma * weights["driver"] + 
-                      trainer_rating.sigma * weights["trainer"])
-    
-    return trueskill.Rating(mu=combined_mu, sigma=combined_sigma)
-
-
-def get_competitors_in_race(db_name: str, race_date: datetime.datetime, race_track: str, 
-                           race_number: int, person_type: str) -> List[Tuple[str, trueskill.Rating]]:
-    """
-    Get all drivers or trainers competing in a specific race.
-    Returns a list of (name, rating) tuples.
-    """
-    with sqlite3.connect(f'{db_name}.db') as conn:
-        cursor = conn.cursor()
-        query = f'''
-            SELECT {person_type}_name 
-            FROM race_entries
-            WHERE race_date = ? AND track = ? AND race_number = ? AND {person_type}_name IS NOT NULL
-        '''
-        cursor.execute(query, (race_date, race_track, race_number))
-        person_names = [row[0] for row in cursor.fetchall()]
-    
-    # Get rating for each person
-    competitors = []
-    for name in person_names:
-        rating = fetch_and_decay_person_rating(db_name, name, person_type, race_date, race_track)
-        competitors.append((name, rating))
-    
-    return competitors
-
-
-# -------------------------------------------------------------------------------------
-# Parsing Functions Module
-# -------------------------------------------------------------------------------------
-def parse_finish(token: str) -> Optional[int]:
-    """Extract the numeric finish position from a finish token."""
-    if not token: return None
-    if "/" in token:
-        parts = token.split("/")
-        for part in parts:
-            num_str = re.sub(r'\D', '', part)
-            if num_str:
-                try: return int(num_str)
-                except ValueError: continue
-        return None
-    else:
-        try: return int(re.sub(r'\D', '', token))
-        except ValueError: return None
-
-
-def parse_horse_line(tokens: List[str]) -> Optional[Dict[str, Any]]:
-    """
-    Parse a line of horse data including driver and trainer info with improved name handling.
-    Better handles names with prefixes (Mc, Mac, Van, etc.) and suffixes (Jr, Sr, etc.).
-    """
-    if not tokens:
-        return None
-
-    # Extract basic horse info (same as before)
-    hn = tokens[0]
-    allowed_signifiers = {"A", "N", "F", "S","B","T", "C", "D", "E", "G", "H", "I", "J", "K", "L", "M", "O", "P", "Q", "R", "U", "V", "W", "Y", "Z"}
-    name_tokens = []
-    i = 1
-    while i < len(tokens) and not (tokens[i].isdigit() or tokens[i].upper().startswith("SCR")):
-        # Skip break indicators like "x4", "x5x", etc.
-        if re.fullmatch(r'[xX]\d{1,2}[xX]?', tokens[i]):
-            i += 1
-            continue
-        token_clean = re.sub(r'[^A-Za-z]', '', tokens[i])
-        if (len(token_clean) > 1 and token_clean.isalpha()) or (len(token_clean) == 1 and token_clean.upper() in allowed_signifiers):
-            name_tokens.append(tokens[i])
-        i += 1
-    horse_name = " ".join(name_tokens).lower() if name_tokens else None
-
-    if i >= len(tokens) or not horse_name:
-        return None
-        
-    pp = tokens[i]
-    pp_clean = re.sub(r'[xX]', '', pp).strip(".,;:-")
-    is_scratched = (pp_clean.upper() == "SCR")
-    i += 1
-
-    # Process finish position and odds (same as before)
-    odds_index = None
-    odds = None
-    for idx, token in enumerate(tokens):
-        if re.match(r'^\*?\d+\.\d{2}$', token):
-            odds_index = idx
-            odds = token
-            break
-
-    # ... rest of finish position code (unchanged) ...
-    finish_candidate = None
-    if odds_index is not None:
-        start_idx = max(0, odds_index - 6)
-        window = tokens[start_idx:odds_index]
-        for j in range(len(window) - 1, 0, -1):
-            if "/" in window[j]:
-                finish_candidate = window[j - 1]
-                break
-
-    if finish_candidate is None and odds_index is not None:
-        window = tokens[max(0, odds_index - 6):odds_index]
-        for token in reversed(window):
-            token_clean = re.sub(r'[xX]', '', token).strip(".,;:-")
-            if token_clean.isdigit():
-                finish_candidate = token_clean
-                break
-
-    if odds_index is None and i + 4 < len(tokens):
-        finish_candidate = tokens[i+4]
-        i += 5
-
-    if finish_candidate is not None:
-        finish_candidate = re.sub(r'[xX]', '', finish_candidate).strip(".,;:-")
-
-    if finish_candidate is None:
-        finish = None
-    elif finish_candidate.upper() == "DNF":
-        finish = "DNF"
-    elif "/" in finish_candidate:
-        m = re.match(r'^(\d+)', finish_candidate)
-        finish = int(m.group(1)) if m else None
-    else:
-        m = re.match(r'^(\d+)', finish_candidate)
-        finish = int(m.group(1)) if m else None
-
-    if is_scratched:
-        finish = None
-
-    # Improved driver and trainer name extraction
-    driver_name = None
-    trainer_name = None
-    
-    # Known name prefixes and suffixes
-    name_prefixes = {"mc", "mac", "o'", "de", "van", "von", "la", "le", "st", "ter", "di", "del"}
-    name_suffixes = {"jr", "jr.", "sr", "sr.", "ii", "iii", "iv"}
-    
-    # Find earnings token (typically starts with $)
-    earnings_idx = next(
-        (i for i, t in enumerate(tokens) if t.startswith('$') and re.match(r'^\$\d', t)),
-        None
-    )
-    
-    # Better name detection function
-    def is_name_like(token):
-        # Names should have letters, not be purely numeric or money values
-        return re.search(r'[a-zA-Z]{2}', token) and not token.startswith('$') and not re.match(r'^\d+$', token)
-    
-    # Extended name extraction with smarter handling of prefixes/suffixes
-    def extract_full_name(start_idx, max_tokens=4):  # Increased max_tokens to handle longer names
-        if start_idx >= len(tokens):
-            return None, 0
-            
-        name_parts = []
-        curr_idx = start_idx
-        token_count = 0
-        
-        # Get first part of the name
-        if curr_idx < len(tokens) and is_name_like(tokens[curr_idx]):
-            name_parts.append(tokens[curr_idx])
-            curr_idx += 1
-            token_count += 1
-        else:
-            return None, 0
-            
-        # Handle last name, potentially with prefix
-        if curr_idx < len(tokens) and is_name_like(tokens[curr_idx]):
-            # Check if this might be a name prefix (Mc, Mac, etc.)
-            prefix_detected = False
-            if tokens[curr_idx-1].lower().rstrip('.') in name_prefixes or tokens[curr_idx-1].lower().endswith('mc'):
-                if curr_idx + 1 < len(tokens) and is_name_like(tokens[curr_idx + 1]):
-                    # We likely have a situation like "Ed Mc Neight Jr" - add both parts
-                    name_parts.append(tokens[curr_idx])  # Add "Neight"
-                    curr_idx += 1
-                    token_count += 1
-                    prefix_detected = True
-            
-            if not prefix_detected:
-                name_parts.append(tokens[curr_idx])  # Add last name
-                curr_idx += 1
-                token_count += 1
-                
-        # Check for a suffix (Jr, Sr, etc.)
-        if curr_idx < len(tokens) and token_count < max_tokens:
-            if tokens[curr_idx].lower().rstrip('.') in name_suffixes:
-                name_parts.append(tokens[curr_idx])  # Add suffix
-                curr_idx += 1
-                token_count += 1
-                
-        return " ".join(name_parts).lower() if name_parts else None, token_count
-    
-    # Look between earnings and odds (most common pattern)
-    if earnings_idx is not None and odds_index is not None and odds_index > earnings_idx + 1:
-        # We have a pattern like: $earnings driver_name trainer_name odds
-        curr_idx = earnings_idx + 1
-        
-        # Try to extract driver name
-        driver_name, tokens_used = extract_full_name(curr_idx)
-        curr_idx += tokens_used
-        
-        # Try to extract trainer name if we have more tokens
-        if curr_idx < odds_index:
-            trainer_name, _ = extract_full_name(curr_idx)
-    
-    # If we still don't have names, try explicit markers
-    if not driver_name or not trainer_name:
-        for idx, token in enumerate(tokens):
-            if idx < len(tokens) - 1:
-                if token.lower() in ["dr.", "dr:", "driver:", "driver"]:
-                    driver_name, _ = extract_full_name(idx + 1)
-                elif token.lower() in ["tr.", "tr:", "trainer:", "trainer"]:
-                    trainer_name, _ = extract_full_name(idx + 1)
-    
-    # One last attempt - look after odds
-    if (not driver_name or not trainer_name) and odds_index is not None and odds_index + 1 < len(tokens):
-        if not driver_name:
-            driver_name, tokens_used = extract_full_name(odds_index + 1)
-            if not trainer_name and driver_name and odds_index + 1 + tokens_used < len(tokens):
-                trainer_name, _ = extract_full_name(odds_index + 1 + tokens_used)
-    
-    # Special case handling for common name patterns
-    # This is where we can add specific handling for cases like "Ed Mc Neight Jr"
-    if driver_name and not trainer_name and driver_name.startswith("mc "):
-        # Handle "Mc" prefix specifically if it's at the start
-        parts = driver_name.split()
-        if len(parts) >= 3:  # We have something like "mc neight jr"
-            driver_name = " ".join(parts[:2])  # "mc neight"
-            trainer_name = " ".join(parts[2:])  # "jr" or whatever follows
-    
-    # Validate names - ensure they contain alphabetic characters
-    if driver_name and not re.search(r'[a-z]', driver_name):
-        driver_name = None
-        
-    if trainer_name and not re.search(r'[a-z]', trainer_name):
-        trainer_name = None
-        
-    # Additional check for "Mc" names
-    if driver_name and "mc " in driver_name and len(driver_name.split()) >= 2:
-        # Let's make sure we're not cutting off part of a "Mc..." name
-        name_parts = driver_name.split()
-        if len(name_parts) >= 2 and name_parts[0].lower() in ["mc", "mac"]:
-            # We need to examine what's after this position to see if part of name got cut off
-            # This is complex logic that would need custom handling
-            pass
-    
-    # Same check for trainer names
-    if trainer_name and "mc " in trainer_name and len(trainer_name.split()) >= 2:
-        name_parts = trainer_name.split()
-        if len(name_parts) >= 2 and name_parts[0].lower() in ["mc", "mac"]:
-            pass
-    
-    return {
-        "hn": hn,
-        "horse_name": horse_name,
-        "pp": pp_clean,
-        "is_scratched": is_scratched,
-        "finish": finish,
-        "odds": odds,
-        "driver_name": driver_name,
-        "trainer_name": trainer_name
-    }
-    
-def parse_races_from_text(results_text: str) -> List[Dict[str, Any]]:
-    """Parse a block of OCR-extracted text into a list of race dictionaries."""
-    # Pre-processing steps
-    results_text = re.sub(r'(\*?\d+\.\d+)([A-Z])', r'\1 \2', results_text) # Separate odds and letters
-    results_text = results_text.replace('\f', '\n') # Replace form feeds with newlines
-
-    # Split into potential race blocks based on "RACE #"
-    # Using positive lookbehind to keep the delimiter
-    race_blocks_with_labels = re.split(r'(?=RACE\s+\d+)', results_text)
-
-    races = []
-    current_race_content = ""
-
-    for block in race_blocks_with_labels:
-        block = block.strip()
-        if not block: continue
-
-        # Attempt to parse header info from the block
-        m_num = re.search(r'^RACE\s+(\d+)', block, re.IGNORECASE)
-        if m_num: # Start of a new race detected
-            # Process the previous race's content if it exists
-            if current_race_content:
-                parsed_race = parse_single_race_content(current_race_content)
-                if parsed_race: races.append(parsed_race)
-
-            # Start accumulating content for the new race
-            current_race_content = block
-        else:
-            # Append content to the current race block
-            current_race_content += "\n" + block
-
-    # Process the last accumulated race content
-    if current_race_content:
-        parsed_race = parse_single_race_content(current_race_content)
-        if parsed_race: races.append(parsed_race)
-
-    return races
-
-# Helper function to parse content of a single race
-def parse_single_race_content(race_content: str) -> Optional[Dict[str, Any]]:
-    """Parses the accumulated text content for a single race."""
-        # Strip out anything between "Conditions:" and the next "Gait:"
-    race_content = re.sub(r'Conditions:.*?(?=Gait:)', '', race_content, flags=re.DOTALL | re.IGNORECASE)
-
-    m_num = re.search(r'^RACE\s+(\d+)', race_content, re.IGNORECASE)
-    if not m_num: return None
-    race_number = int(m_num.group(1))
-
-    gait_match = re.search(r'Gait:\s*(Trot|Pace)', race_content, re.IGNORECASE)
-    gait_value = gait_match.group(1).title() if gait_match else "Unknown" # Default or log warning?
-
-    date_time_pattern = (r'((?:January|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June|July|Aug(?:ust)?|'
-                         r'Sept(?:ember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\s+\d{1,2},\s*\d{4}'
-                         r'(?:\s+\d{1,2}:\d{1,2}\s*(?:AM|PM))?)') # Adjusted pattern
-    date_match = re.search(date_time_pattern, race_content)
-    race_datetime = None
-    if date_match:
-        date_str = date_match.group(1)
-        # Try parsing with time first, then date only
-        for fmt in ["%B %d, %Y %I:%M %p", "%B %d, %Y"]:
-             try:
-                 race_datetime = datetime.datetime.strptime(date_str, fmt)
-                 if "%I:%M %p" not in fmt: # If date only, set default time (e.g., noon)
-                      race_datetime = race_datetime.replace(hour=12, minute=0, second=0, microsecond=0)
-                 break
-             except ValueError:
-                 continue
-
-    # Attempt to refine time using 'Off:' time if date was found
-    if race_datetime:
-        off_match = re.search(r'Off:\s*(\d{1,2}:\d{1,2}(?:\s*[APap][Mm])?)', race_content)
-        if off_match:
-            off_time_str = off_match.group(1).replace(" ", "") # Remove spaces for parsing
-            # Add PM if missing, assuming races are usually PM
-            if not re.search(r'[APap][Mm]', off_time_str, re.IGNORECASE):
-                off_time_str += "PM"
-            try:
-                off_time = datetime.datetime.strptime(off_time_str.upper(), "%I:%M%p").time()
-                race_datetime = race_datetime.replace(hour=off_time.hour, minute=off_time.minute, second=0, microsecond=0)
-            except ValueError:
-                 logging.warning(f"Could not parse Off time '{off_match.group(1)}' for Race {race_number}")
-
-
-    known_tracks = [
-        "Hollywood Casino at The Meadows", "MEADOWLANDS", "Northfield Park",
-        "Miami Valley Raceway", "Yonkers Raceway", "Harrah's Philadelphia",
-        "Woodbine Mohawk Park", "Hoosier Park", "Pocono Downs" # Add more known tracks
-    ]
-    track_name = "Unknown Track"
-    # Use word boundaries for more robust matching
-    for known in known_tracks:
-        if re.search(r'\b' + re.escape(known) + r'\b', race_content, re.IGNORECASE):
-             track_name = known # Use the canonical name
-             break
-
-    starters_match = re.search(r'(?i)(Strs|Starters):\s*(\d+)', race_content)
-    starters = int(starters_match.group(2)) if starters_match else None
-
-    # Mark race as qualifier?
-    is_qualifier = bool(re.search(r'(?m)^\s*Purse\s*[:=]?\s*\$0\b', race_content, re.IGNORECASE) or
-                       re.search(r'\bqualifier\b', race_content, re.IGNORECASE))
-        # Try to extract race class (between "Purse" and "1 Mile"/"Distance")
-    class_match = re.search(r'Purse\s*[:=]?\s*\$[\d,]+\s+(.*?)\s+(?:1\s*Mile|1M|1\.0M|Distance)', race_content, re.IGNORECASE)
-    race_class = class_match.group(1).strip() if class_match else None
-
-
-    horses = []
-    lines = race_content.split('\n')
-    table_started = False
-    for line in lines:
-        line_stripped = line.strip()
-        if not line_stripped or line_stripped.lower().startswith("http"): continue
-
-        # More robust header check, allowing variations
-        if RE_HEADER.search(line_stripped) or "Post" in line_stripped: # Added "Post" as potential indicator
-            table_started = True
-            continue
-
-        if table_started:
-            # More robust end-of-table check
-            if line_stripped.startswith("Time:") or "Pool:" in line_stripped or "Total:" in line_stripped:
-                break # Stop processing lines for horses
-
-            cols = re.split(r'\s{2,}', line_stripped) # Split on 2+ spaces, might be better
-            if len(cols) < 2: # Need at least HN and something else
-                 # Try splitting by single space if multi-space failed
-                 cols = re.split(r'\s+', line_stripped)
-                 if len(cols) < 5: # Heuristic: need more columns if single space separated
-                      continue
-
-            try:
-                horse_info = parse_horse_line(cols)
-                if horse_info:
-                    horses.append({
-                        "horse_name": horse_info["horse_name"], # Already stripped in parse_horse_line
-                        "finish": horse_info["finish"],
-                        "odds": horse_info["odds"],
-                        "is_scratched": horse_info["is_scratched"],
-                        "driver_name": horse_info.get("driver_name"),  # Add driver name
-                        "trainer_name": horse_info.get("trainer_name")  # Add trainer name
-                    })
-            except Exception as e:
-                 logging.error(f"Error parsing line in Race {race_number}: '{line_stripped}'. Error: {e}")
-                 continue # Skip problematic lines
-
-    # Only return race if horses were found
-    if not horses:
-        return None
-
-    return {
-        "race_number": race_number,
-        "date": race_datetime,
-        "track": track_name,
-        "gait": gait_value,
-        "horses": horses,
-        "is_qualifier": is_qualifier,
-        "starters": starters, # May be None
-        "race_class": race_class
-
-    }
-
-# -------------------------------------------------------------------------------------
-# TrueSkill Processing Module
-# -------------------------------------------------------------------------------------
-def process_parsed_race(race: Dict[str, Any]) -> None:
-    """
-    Process a single race: determines DB, fetches/decays ratings, updates ratings using TrueSkill,
-    and logs results. Handles qualifiers by only updating last_played/last_track.
-    Now handles drivers and trainers as well as horses.
-    """
-    # Basic validation of the race dictionary
-    if not all(k in race for k in ["gait", "horses", "date", "track", "race_number"]):
-        logging.error(f"Skipping incomplete race data: {race.get('race_number', 'Unknown')}")
-        return
-
-    gait_value = race["gait"].strip().lower()
-    # Allow for "Galt" -> "Trot" correction
-    if gait_value.startswith("galt"):
-        gait_value = "trot"
-    race["gait"] = gait_value # Update dict if corrected
-
-    # Determine database name
-    db_name = "trotters" if gait_value == "trot" else "pacers"
-    # Initialize DB (creates tables/columns if needed) - safe to call repeatedly
-    init_db(db_name)
-
-    # Filter out scratched horses and those without a valid integer finish position
-    valid_horses = [h for h in race["horses"] if not h.get("is_scratched", False) and isinstance(h.get("finish"), int)]
-
-    if len(valid_horses) < 2:
-        logging.warning(f"Race {race.get('race_number')} at {race.get('track')} has less than 2 valid finishers. Skipping rating update.")
-        # Optionally, still update last_played/last_track for all participants?
-        # Decide if even single finishers should have their date/track updated.
-        # For now, we just skip the whole race if < 2 finishers.
-        return
-
-    # Sort by finish position for TrueSkill ranks
-    sorted_horses = sorted(valid_horses, key=lambda x: x["finish"])
-    horse_names = [h["horse_name"].lower() for h in sorted_horses] # Use lowercase names consistently
-    race_date = race["date"]
-    race_track = race["track"] # Get track name
-
-    # Handle Qualifier Races - No Rating Change, Just Update Activity
-    if race.get("is_qualifier", False):
-        logging.info(f"Processing Qualifier Race {race['race_number']} at {race_track}. Updating last played/track only.")
-        for horse_info in race["horses"]:
-            if horse_info.get("is_scratched"): continue # Skip scratched
-
-            horse_name = horse_info["horse_name"].lower()
-            # Fetch current rating just to pass to update function (mu/sigma won't change)
-            rating, _ = get_player_rating(db_name, horse_name, race_date)
-            if rating:
-                # Update last_played date and last_track name
-                update_player_rating(db_name, horse_name, rating, race_date, race_track)
-            else:
-                # Add horse if new, setting last_played and last_track
-                add_horse(db_name, horse_name, race_date, race_track)
-                
-            # Update last_played for driver if available
-            driver_name = horse_info.get("driver_name")
-            if driver_name:
-                driver_rating = get_person_rating(db_name, driver_name, "driver", race_date)
-                if driver_rating:
-                    update_person_rating(db_name, driver_name, "driver", driver_rating, race_date, race_track)
-                else:
-                    add_person(db_name, driver_name, "driver", race_date, race_track)
-
-            # Update last_played for trainer if available
-            trainer_name = horse_info.get("trainer_name")
-            if trainer_name:
-                trainer_rating = get_person_rating(db_name, trainer_name, "trainer", race_date)
-                if trainer_rating:
-                    update_person_rating(db_name, trainer_name, "trainer", trainer_rating, race_date, race_track)
-                else:
-                    add_person(db_name, trainer_name, "trainer", race_date, race_track)
-                
-        return # Stop processing for qualifiers
-
-    # --- Process Regular Race for Rating Updates ---
-    
-    # Store race entries for future reference
-    for horse_info in sorted_horses:
-        horse_name = horse_info["horse_name"].lower()
-        driver_name = horse_info.get("driver_name")
-        trainer_name = horse_info.get("trainer_name")
-        finish_position = str(horse_info["finish"])
-        
-        store_race_entry(
-            db_name, race_date, race_track, race["race_number"],
-            horse_name, driver_name, trainer_name,
-            finish_position, race.get("race_class"),
-            race["gait"], race.get("is_qualifier", False)
-        )
-
-    # Prepare ranks for TrueSkill (0-based index)
-    # Handle potential ties if needed, TrueSkill's rate function takes ranks
-    ranks_0_based = [h["finish"] - 1 for h in sorted_horses] # Assumes finish is 1, 2, 3...
-
-    # Process horse ratings
-    # Fetch existing ratings (with decay applied) or create new ones
-    # Pass race_track to fetch_and_decay_rating in case it needs to add the horse
-    decayed_ratings = [fetch_and_decay_rating(db_name, name, race_date, race_track) for name in horse_names]
-
-    # Format for TrueSkill (each horse is a 'team' of one)
-    teams = [(r,) for r in decayed_ratings]
-
-    try:
-        # Calculate new ratings
-        updated_teams = trueskill.rate(teams, ranks=ranks_0_based)
-    except Exception as e:
-        logging.error(f"TrueSkill rating failed for Race {race['race_number']} at {race_track}. Error: {e}")
-        return # Skip updating if rating calculation fails
-
-    # Update database with new ratings and log history
-    logging.info("--- Processed Race %d (%s) at %s on %s ---", race['race_number'], race['gait'].title(), race_track, race_date)
-    for horse_info, old_rating_tuple, updated_team in zip(sorted_horses, teams, updated_teams):
-        horse_name = horse_info["horse_name"].lower()
-        new_rating = updated_team[0]
-        old_rating = old_rating_tuple[0] # Get the rating before the update for logging comparison
-
-        # Update player_ratings with new mu, sigma, last_played, last_track
-        update_player_rating(db_name, horse_name, new_rating, race_date, race_track)
-
-        # Log this result to horse_history, passing the track name
-        log_horse_race(
-            db_name,
-            horse_name,
-            new_rating.mu,
-            new_rating.sigma,
-            race_date,
-            race_track,
-            finish_position=str(horse_info.get("finish")),
-            race_class=race.get("race_class")
-        )
-
-        # Log details
-        logging.info("  [%s] %s (Fin: %s) -> Mu: %.2f -> %.2f, Sigma: %.2f -> %.2f",
-                     horse_info.get("hn", "?"), # Include HN if available
-                     horse_info['horse_name'],
-                     horse_info['finish'],
-                     old_rating.mu, new_rating.mu,
-                     old_rating.sigma, new_rating.sigma)
-    
-    # Process driver ratings
-    driver_entities = []
-    for horse_info in sorted_horses:
-        driver_name = horse_info.get("driver_name")
-        if not driver_name:
-            continue
-            
-        # Get or create driver rating
-        driver_rating = fetch_and_decay_person_rating(db_name, driver_name, "driver", race_date, race_track)
-        driver_rank = horse_info["finish"] - 1  # 0-based for TrueSkill
-        
-        driver_entities.append({
-            "name": driver_name,
-            "rating": driver_rating,
-            "rank": driver_rank,
-            "horse_name": horse_info["horse_name"]
-        })
-
-    # Update driver ratings if we have any
-    if driver_entities:
-        # Format for TrueSkill
-        driver_teams = [(r["rating"],) for r in driver_entities]
-        driver_ranks = [r["rank"] for r in driver_entities]
-        
-        try:
-            # Calculate new ratings
-            updated_driver_teams = trueskill.rate(driver_teams, ranks=driver_ranks)
-            
-            # Update database with new ratings and log history
-            for driver_info, updated_team in zip(driver_entities, updated_driver_teams):
-                driver_name = driver_info["name"]
-                new_rating = updated_team[0]
-                old_rating = driver_info["rating"]
-                
-                # Update driver_ratings
-                update_person_rating(db_name, driver_name, "driver", new_rating, race_date, race_track)
-                
-                # Log history
-                log_person_race(
-                    db_name, driver_name, "driver", new_rating.mu, new_rating.sigma,
-                    race_date, race_track, driver_info["horse_name"], 
-                    str(driver_info["rank"] + 1), race.get("race_class")
-                )
-                
-                # Log to console
-                logging.info(f"Driver: {driver_name} (Finish: {driver_info['rank'] + 1}) -> "
-                            f"Mu: {old_rating.mu:.2f} -> {new_rating.mu:.2f}")
-                
-        except Exception as e:
-            logging.error(f"TrueSkill rating failed for drivers in Race {race['race_number']} at {race_track}. Error: {e}")
-    
-    # Process trainer ratings
-    trainer_entities = []
-    for horse_info in sorted_horses:
-        trainer_name = horse_info.get("trainer_name")
-        if not trainer_name:
-            continue
-            
-        # Get or create trainer rating
-        trainer_rating = fetch_and_decay_person_rating(db_name, trainer_name, "trainer", race_date, race_track)
-        trainer_rank = horse_info["finish"] - 1  # 0-based for TrueSkill
-        
-        trainer_entities.append({
-            "name": trainer_name,
-            "rating": trainer_rating,
-            "rank": trainer_rank,
-            "horse_name": horse_info["horse_name"]
-        })
-
-    # Update trainer ratings if we have any
-    if trainer_entities:
-        # Format for TrueSkill
-        trainer_teams = [(r["rating"],) for r in trainer_entities]
-        trainer_ranks = [r["rank"] for r in trainer_entities]
-        
-        try:
-            # Calculate new ratings
-            updated_trainer_teams = trueskill.rate(trainer_teams, ranks=trainer_ranks)
-            
-            # Update database with new ratings and log history
-            for trainer_info, updated_team in zip(trainer_entities, updated_trainer_teams):
-                trainer_name = trainer_info["name"]
-                new_rating = updated_team[0]
-                old_rating = trainer_info["rating"]
-                
-                # Update trainer_ratings
-                update_person_rating(db_name, trainer_name, "trainer", new_rating, race_date, race_track)
-                
-                # Log history
-                log_person_race(
-                    db_name, trainer_name, "trainer", new_rating.mu, new_rating.sigma,
-                    race_date, race_track, trainer_info["horse_name"], 
-                    str(trainer_info["rank"] + 1), race.get("race_class")
-                )
-                
-                # Log to console
-                logging.info(f"Trainer: {trainer_name} (Finish: {trainer_info['rank'] + 1}) -> "
-                            f"Mu: {old_rating.mu:.2f} -> {new_rating.mu:.2f}")
-                
-        except Exception as e:
-            logging.error(f"TrueSkill rating failed for trainers in Race {race['race_number']} at {race_track}. Error: {e}")
-
-# -------------------------------------------------------------------------------------
-# Main Script Module
-# -------------------------------------------------------------------------------------
-def main() -> None:
-    global DRY_RUN
-    parser = argparse.ArgumentParser(description="Update horse ratings from race file.")
-    parser.add_argument("--dry-run", action="store_true", help="Run without writing to database")
-    args = parser.parse_args()
-    DRY_RUN = args.dry_run
-    if DRY_RUN:
-        logging.info("Running in DRY RUN mode – no changes will be written to the database.")
-
-    # Setup TrueSkill environment
-    # Using mpmath for potentially higher precision if needed, can revert to default if not required
-    try:
-        import mpmath
-        mpmath.mp.dps = 50 # Set decimal places precision
-        trueskill.setup(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA, beta=DEFAULT_SIGMA/2, tau=DEFAULT_SIGMA/100, draw_probability=0.0, backend='mpmath')
-        logging.info("Using mpmath backend for TrueSkill.")
-    except ImportError:
-        trueskill.setup(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA, beta=DEFAULT_SIGMA/2, tau=DEFAULT_SIGMA/100, draw_probability=0.0)
-        logging.info("mpmath not found. Using default backend for TrueSkill.")
-
-
-    # File containing the race results text
-    txt_file = "upload.txt" # Make sure this file exists in the same directory or provide full path
-    try:
-        with open(txt_file, "r", encoding="utf-8") as f:
-            raw_text = f.read()
-            logging.info(f"Successfully read {len(raw_text)} characters from {txt_file}")
-    except FileNotFoundError:
-        logging.error(f"Error: Input file '{txt_file}' not found.")
-        return
-    except Exception as e:
-        logging.error(f"Error reading file '{txt_file}': {e}")
-        return
-
-    # Parse the raw text into structured race data
-    all_races = parse_races_from_text(raw_text)
-    logging.info(f"Parsed {len(all_races)} potential races from text.")
-
-    # Process each parsed race
-    processed_count = 0
-    for race in all_races:
-        # Basic check if race dictionary seems valid before processing
-        if race and race.get("horses"):
-            try:
-                process_parsed_race(race)
-                processed_count += 1
-            except Exception as e:
-                # Catch potential errors during processing of a single race
-                logging.error(f"Unhandled error processing Race {race.get('race_number', 'Unknown')} at {race.get('track', 'Unknown')}: {e}", exc_info=True) # Log stack trace
-        else:
-             logging.warning("Skipping invalid or empty race data block.")
-
-    logging.info(f"Finished processing. Attempted to process {processed_count} races.")
-
-
-if __name__ == "__main__":
+import re
+import os
+import sys
+import sqlite3
+import datetime
+import math
+import logging
+import threading
+import atexit
+import functools
+import concurrent.futures
+import itertools
+import mmap
+from typing import Optional, Tuple, Dict, Any, List
+import numpy as np
+import trueskill
+import argparse
+
+
+# -------------------------------------------------------------------------------------
+# Configuration and Global Constants
+# -------------------------------------------------------------------------------------
+DEFAULT_MU = 1000
+DEFAULT_SIGMA = 333.333
+MAX_DECAY = 0.50
+MIN_DAYS_NO_DECAY = 28
+MAX_DAYS_DECAY = 365
+
+# Weights for combined rating calculation
+HORSE_WEIGHT = 0.8
+DRIVER_WEIGHT = 0.1
+TRAINER_WEIGHT = 0.1
+
+# Flag for dry run (set by command line arg)
+DRY_RUN = False
+
+# Shared immutable default rating; trueskill.Rating is tuple-like, so one
+# instance can back every new competitor instead of a fresh allocation.
+DEFAULT_RATING = trueskill.Rating(DEFAULT_MU, DEFAULT_SIGMA)
+
+# Precompiled regex patterns for performance
+RE_DT = re.compile(r'(\d{4})-(\d{2})-(\d{2})[ T](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?')
+RE_ODDS = re.compile(r'^\*?\d+\.\d{2}$')
+RE_FINISH_DIGITS = re.compile(r'^(\d+)')
+RE_BREAK = re.compile(r'[xX]\d{1,2}[xX]?')
+RE_NAMELIKE = re.compile(r'[a-zA-Z]{2}')
+RE_HEADER = re.compile(r'HN\s+(Horse|horsa)\s+PP', re.IGNORECASE)
+
+# Race-text patterns, compiled once instead of per call in the parse loop
+RE_ODDS_SEP = re.compile(r'(\*?\d+\.\d+)([A-Z])')
+RE_RACE_SPLIT = re.compile(r'(?=RACE\s+\d+)')
+RE_RACE_NUM = re.compile(r'^RACE\s+(\d+)', re.IGNORECASE)
+RE_CONDITIONS_GAIT = re.compile(r'Conditions:.*?(?=Gait:)', re.DOTALL | re.IGNORECASE)
+RE_GAIT = re.compile(r'Gait:\s*(Trot|Pace)', re.IGNORECASE)
+RE_DATE_TIME = re.compile(
+    r'((?:January|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June|July|Aug(?:ust)?|'
+    r'Sept(?:ember)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)\s+\d{1,2},\s*\d{4}'
+    r'(?:\s+\d{1,2}:\d{1,2}\s*(?:AM|PM))?)')
+RE_OFF = re.compile(r'Off:\s*(\d{1,2}:\d{1,2}(?:\s*[APap][Mm])?)')
+# Splits a matched date string into parts; with MONTH_LOOKUP this replaces
+# strptime, which re-parses its format string on every call
+RE_DATE_PARTS = re.compile(r'(\w+)\s+(\d{1,2}),\s*(\d{4})(?:\s+(\d{1,2}):(\d{1,2})\s*(AM|PM))?')
+MONTH_LOOKUP = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+                "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+RE_AMPM = re.compile(r'[APap][Mm]', re.IGNORECASE)
+RE_STARTERS = re.compile(r'(Strs|Starters):\s*(\d+)', re.IGNORECASE)
+RE_PURSE_ZERO = re.compile(r'^\s*Purse\s*[:=]?\s*\$0\b', re.IGNORECASE | re.MULTILINE)
+RE_QUALIFIER = re.compile(r'\bqualifier\b', re.IGNORECASE)
+RE_CLASS = re.compile(r'Purse\s*[:=]?\s*\$[\d,]+\s+(.*?)\s+(?:1\s*Mile|1M|1\.0M|Distance)', re.IGNORECASE)
+RE_MULTI_SPACE = re.compile(r'\s{2,}')
+# Horse table rows start with a program number like '4' or '4A'
+RE_HORSE_ROW = re.compile(r'^\s*\d+[A-Z]?\s')
+# Bytes twin of RE_RACE_SPLIT, for finding block boundaries in the mmap
+RE_RACE_BLOCK_B = re.compile(rb'RACE\s+\d+')
+
+# Canonical track names matched with a single alternation instead of one
+# scan of the race text per track. Interned so downstream equality checks
+# and dict probes short-circuit on identity.
+KNOWN_TRACKS = [sys.intern(t) for t in (
+    "Hollywood Casino at The Meadows", "MEADOWLANDS", "Northfield Park",
+    "Miami Valley Raceway", "Yonkers Raceway", "Harrah's Philadelphia",
+    "Woodbine Mohawk Park", "Hoosier Park", "Pocono Downs" # Add more known tracks
+)]
+UNKNOWN_TRACK = sys.intern("Unknown Track")
+# Canonical gait strings, keyed by the lowercased regex capture
+GAIT_CANON = {"trot": sys.intern("Trot"), "pace": sys.intern("Pace")}
+RE_KNOWN_TRACK = re.compile(
+    r'\b(' + '|'.join(re.escape(t) for t in KNOWN_TRACKS) + r')\b', re.IGNORECASE)
+TRACK_CANON = {t.lower(): t for t in KNOWN_TRACKS}
+
+# Minimum number of race blocks before text parsing is farmed out to
+# worker processes; below this the pool startup outweighs the win.
+PARALLEL_PARSE_THRESHOLD = 8
+
+# Delete tables for the tokenizer hot path: str.translate strips characters
+# in C, replacing the per-token re.sub calls.
+_NONDIGIT_TABLE = str.maketrans('', '', ''.join(chr(c) for c in range(256) if not chr(c).isdigit()))
+_NONALPHA_TABLE = str.maketrans('', '', ''.join(chr(c) for c in range(256) if not ('A' <= chr(c) <= 'Z' or 'a' <= chr(c) <= 'z')))
+_X_TABLE = {ord('x'): None, ord('X'): None}
+
+# Known name prefixes and suffixes, shared across every parsed horse line.
+# Tokens are matched after .lower().rstrip('.'), so dotted variants are
+# unnecessary.
+_NAME_PREFIXES = frozenset({"mc", "mac", "o'", "de", "van", "von", "la", "le", "st", "ter", "di", "del"})
+_NAME_SUFFIXES = frozenset({"jr", "sr", "ii", "iii", "iv"})
+
+# Explicit role markers and single-letter signifiers, matched after
+# .lower()/.upper() respectively; built once instead of per line.
+DRIVER_MARKERS = frozenset({"dr.", "dr:", "driver:", "driver"})
+# Prefixes that end the horse table; a tuple makes startswith one C call
+END_TABLE_PREFIXES = ("Time:",)
+TRAINER_MARKERS = frozenset({"tr.", "tr:", "trainer:", "trainer"})
+ALLOWED_SIGNIFIERS = frozenset({"A", "N", "F", "S", "B", "T", "C", "D", "E", "G", "H", "I", "J", "K", "L", "M", "O", "P", "Q", "R", "U", "V", "W", "Y", "Z"})
+
+
+def _parse_dt(value: str) -> Optional[datetime.datetime]:
+    """
+    Parse a stored SQLite timestamp ('YYYY-MM-DD HH:MM[:SS[.ffffff]]').
+
+    fromisoformat is C-implemented and covers every format this script has
+    ever written; the regex fallback handles any stragglers without the
+    strptime format loop, whose exception-driven misses made it the hot
+    path of every rating fetch.
+    """
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        pass
+    m = RE_DT.match(value)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second, frac = m.groups()
+    microsecond = int(frac[:6].ljust(6, '0')) if frac else 0
+    return datetime.datetime(int(year), int(month), int(day),
+                             int(hour), int(minute), int(second or 0), microsecond)
+
+
+# -------------------------------------------------------------------------------------
+# Logging Configuration
+# -------------------------------------------------------------------------------------
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+
+# -------------------------------------------------------------------------------------
+# Database Functions Module
+# -------------------------------------------------------------------------------------
+_LOCAL = threading.local()
+
+# One straight-line adapter for datetime parameters: a single isoformat
+# call per bound value, registered once (this also future-proofs against
+# the deprecated implicit default adapter). timespec stays 'auto' so the
+# stored strings stay byte-identical to the legacy implicit adapter's —
+# existing rows keep comparing equal on race_date keys.
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(sep=' '))
+
+
+def get_conn(db_name: str) -> sqlite3.Connection:
+    """
+    Return a cached per-thread connection for db_name, opening it on first use.
+
+    Opening a connection re-parses the schema, and the default PRAGMAs
+    (journal_mode=DELETE, synchronous=FULL) cost two fsyncs per commit. The
+    first open switches to WAL with relaxed-but-safe durability and a larger
+    page cache; every DB function reuses the handle. `with get_conn(...) as
+    conn:` still scopes a transaction — the context manager commits without
+    closing.
+    """
+    conns = getattr(_LOCAL, "conns", None)
+    if conns is None:
+        conns = _LOCAL.conns = {}
+    conn = conns.get(db_name)
+    if conn is None:
+        # isolation_level=None: no implicit transaction management, so the
+        # batched writers control their own BEGIN IMMEDIATE/COMMIT and
+        # single-row writes autocommit per statement.
+        conn = sqlite3.connect(f'{db_name}.db', isolation_level=None)
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-65536")
+        # Pick up any existing sqlite_stat1 entries before the first query.
+        cursor.execute("PRAGMA optimize")
+        conns[db_name] = conn
+    return conn
+
+
+@atexit.register
+def _optimize_on_exit() -> None:
+    """Run the analysis-limited PRAGMA optimize on every cached connection."""
+    for conn in getattr(_LOCAL, "conns", {}).values():
+        try:
+            conn.execute("PRAGMA optimize=0x10002")
+        except sqlite3.Error:
+            pass
+
+
+def init_db(db_name: str) -> None:
+    """
+    Create a database and tables if they do not exist.
+    Now includes tables for drivers and trainers alongside horses.
+    """
+    # All seven CREATE TABLE statements go to SQLite as one script inside
+    # one explicit transaction, instead of seven round trips each in its
+    # own implicit transaction.
+    get_conn(db_name).executescript('''
+        BEGIN;
+
+        CREATE TABLE IF NOT EXISTS player_ratings (
+            player_name TEXT PRIMARY KEY,
+            mu REAL,
+            sigma REAL,
+            last_played DATETIME,
+            last_track TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS horse_history (
+            player_name TEXT,
+            mu REAL,
+            sigma REAL,
+            race_date DATETIME,
+            last_track TEXT,
+            finish_position TEXT,
+            race_class TEXT,
+            FOREIGN KEY(player_name) REFERENCES player_ratings(player_name)
+        );
+
+        CREATE TABLE IF NOT EXISTS driver_ratings (
+            driver_name TEXT PRIMARY KEY,
+            mu REAL,
+            sigma REAL,
+            last_raced DATETIME,
+            last_track TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS driver_history (
+            driver_name TEXT,
+            mu REAL,
+            sigma REAL,
+            race_date DATETIME,
+            last_track TEXT,
+            horse_name TEXT,
+            finish_position TEXT,
+            race_class TEXT,
+            FOREIGN KEY(driver_name) REFERENCES driver_ratings(driver_name)
+        );
+
+        CREATE TABLE IF NOT EXISTS trainer_ratings (
+            trainer_name TEXT PRIMARY KEY,
+            mu REAL,
+            sigma REAL,
+            last_raced DATETIME,
+            last_track TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS trainer_history (
+            trainer_name TEXT,
+            mu REAL,
+            sigma REAL,
+            race_date DATETIME,
+            last_track TEXT,
+            horse_name TEXT,
+            finish_position TEXT,
+            race_class TEXT,
+            FOREIGN KEY(trainer_name) REFERENCES trainer_ratings(trainer_name)
+        );
+
+        CREATE TABLE IF NOT EXISTS race_entries (
+            race_date DATETIME,
+            track TEXT,
+            race_number INTEGER,
+            horse_name TEXT,
+            driver_name TEXT,
+            trainer_name TEXT,
+            finish_position TEXT,
+            race_class TEXT,
+            gait TEXT,
+            is_qualifier BOOLEAN,
+            PRIMARY KEY(race_date, track, race_number, horse_name)
+        );
+
+        COMMIT;
+    ''')
+    
+    # Ensure columns exist after potential creation
+    add_missing_columns(db_name)
+    add_indexes(db_name)
+
+    # Refresh planner statistics for the indexes above. Usually a no-op;
+    # when stats are stale it builds sqlite_stat1 so race_entries lookups
+    # seek instead of scan.
+    get_conn(db_name).execute("PRAGMA optimize")
+
+
+# Databases whose columns have been verified this process. The schema
+# cannot lose columns mid-run, so repeat calls are a set lookup.
+_COLUMNS_CHECKED: set = set()
+
+# Required columns per table; all additions are TEXT.
+_REQUIRED_COLUMNS = {
+    "player_ratings": ("last_track",),
+    "horse_history": ("last_track", "finish_position", "race_class"),
+}
+
+
+def add_missing_columns(db_name: str) -> None:
+    """
+    Ensure that all tables have the required columns.
+    One PRAGMA table_info pass per table, any ALTERs batched in a single
+    transaction, and at most one full check per database per process.
+    """
+    if db_name in _COLUMNS_CHECKED:
+        return
+
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        for table, needed in _REQUIRED_COLUMNS.items():
+            cursor.execute(f"PRAGMA table_info({table})")
+            columns = {row[1] for row in cursor.fetchall()}
+            for column in needed:
+                if column not in columns:
+                    logging.info(f"Adding {column} column to {table} in {db_name}.db")
+                    cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} TEXT")
+        conn.commit()
+
+    _COLUMNS_CHECKED.add(db_name)
+
+
+def add_indexes(db_name: str) -> None:
+    """Add indexes to improve query performance."""
+    # One script, one transaction for the whole index set. player_name is
+    # the table's PRIMARY KEY and already has an implicit index, so the old
+    # idx_player_name duplicate is dropped.
+    get_conn(db_name).executescript('''
+        BEGIN;
+
+        DROP INDEX IF EXISTS idx_player_name;
+        CREATE INDEX IF NOT EXISTS idx_horse_history_name ON horse_history (player_name);
+        -- Rating-history walks read one horse newest-first; the compound
+        -- index makes that a single index-only scan.
+        CREATE INDEX IF NOT EXISTS idx_horse_history_name_date ON horse_history (player_name, race_date DESC);
+
+        CREATE INDEX IF NOT EXISTS idx_driver_name ON driver_ratings (driver_name);
+        CREATE INDEX IF NOT EXISTS idx_driver_history_name ON driver_history (driver_name);
+
+        CREATE INDEX IF NOT EXISTS idx_trainer_name ON trainer_ratings (trainer_name);
+        CREATE INDEX IF NOT EXISTS idx_trainer_history_name ON trainer_history (trainer_name);
+
+        CREATE INDEX IF NOT EXISTS idx_race_entries_horse ON race_entries (horse_name);
+        CREATE INDEX IF NOT EXISTS idx_race_entries_driver ON race_entries (driver_name);
+        CREATE INDEX IF NOT EXISTS idx_race_entries_trainer ON race_entries (trainer_name);
+        CREATE INDEX IF NOT EXISTS idx_race_entries_date ON race_entries (race_date);
+        -- get_competitors_in_race filters on all three of these with
+        -- equality; single-column indexes left the planner scanning.
+        CREATE INDEX IF NOT EXISTS idx_race_entries_lookup ON race_entries (race_date, track, race_number);
+
+        COMMIT;
+    ''')
+
+
+# Flush statements, built once at import. SQLite caches prepared plans per
+# connection keyed on the SQL text, so reusing identical strings lets every
+# flush hit the cache instead of re-parsing (the per-role variants were
+# previously rebuilt as f-strings on each flush).
+SQL_UPSERT_PLAYER = '''
+    INSERT INTO player_ratings (player_name, mu, sigma, last_played, last_track)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(player_name) DO UPDATE SET
+        mu = excluded.mu, sigma = excluded.sigma,
+        last_played = excluded.last_played, last_track = excluded.last_track
+'''
+SQL_UPSERT_PERSON = {person_type: f'''
+    INSERT INTO {person_type}_ratings ({person_type}_name, mu, sigma, last_raced, last_track)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT({person_type}_name) DO UPDATE SET
+        mu = excluded.mu, sigma = excluded.sigma,
+        last_raced = excluded.last_raced, last_track = excluded.last_track
+''' for person_type in ("driver", "trainer")}
+SQL_INSERT_RACE_ENTRY = '''
+    INSERT OR REPLACE INTO race_entries
+    (race_date, track, race_number, horse_name, driver_name, trainer_name,
+     finish_position, race_class, gait, is_qualifier)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_HORSE_HISTORY = '''
+    INSERT INTO horse_history (player_name, mu, sigma, race_date, last_track, finish_position, race_class)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_PERSON_HISTORY = {person_type: f'''
+    INSERT INTO {person_type}_history
+    ({person_type}_name, mu, sigma, race_date, last_track, horse_name, finish_position, race_class)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+''' for person_type in ("driver", "trainer")}
+
+
+class RaceWriter:
+    """
+    Buffers the per-race DB writes and flushes them in one transaction.
+
+    Each write function historically opened its own connection and committed
+    one row; for a full race card that meant hundreds of fsync-bound
+    transactions. The processing loop opens one RaceWriter per race, the
+    write functions enqueue rows into it, and __exit__ replays every buffer
+    with executemany inside a single commit.
+    """
+
+    # A writer shared across a whole card/backfill flushes early once any
+    # buffer reaches this size, keeping memory bounded while still batching
+    # far beyond single rows.
+    FLUSH_THRESHOLD = 1000
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.race_entries: List[tuple] = []
+        self.horse_history: List[tuple] = []
+        self.person_history: Dict[str, List[tuple]] = {"driver": [], "trainer": []}
+        self.rating_updates: Dict[str, List[tuple]] = {"player": [], "driver": [], "trainer": []}
+
+    def __enter__(self) -> "RaceWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool:
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def queue_race_entry(self, row: tuple) -> None:
+        self.race_entries.append(row)
+        if len(self.race_entries) >= self.FLUSH_THRESHOLD:
+            self.flush()
+
+    def queue_history(self, kind: str, row: tuple) -> None:
+        if kind == "horse":
+            buf = self.horse_history
+        else:
+            buf = self.person_history[kind]
+        buf.append(row)
+        if len(buf) >= self.FLUSH_THRESHOLD:
+            self.flush()
+
+    def queue_rating_update(self, kind: str, row: tuple) -> None:
+        buf = self.rating_updates[kind]
+        buf.append(row)
+        if len(buf) >= self.FLUSH_THRESHOLD:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write all buffered rows in one transaction and clear the buffers."""
+        if not (self.race_entries or self.horse_history
+                or any(self.person_history.values())
+                or any(self.rating_updates.values())):
+            return
+
+        conn = get_conn(self.db_name)
+        cursor = conn.cursor()
+        # BEGIN IMMEDIATE takes the reserved lock up front instead of
+        # upgrading from SHARED mid-transaction.
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if self.rating_updates["player"]:
+                cursor.executemany(SQL_UPSERT_PLAYER, self.rating_updates["player"])
+            for person_type in ("driver", "trainer"):
+                if self.rating_updates[person_type]:
+                    cursor.executemany(SQL_UPSERT_PERSON[person_type], self.rating_updates[person_type])
+            if self.race_entries:
+                cursor.executemany(SQL_INSERT_RACE_ENTRY, self.race_entries)
+            if self.horse_history:
+                cursor.executemany(SQL_INSERT_HORSE_HISTORY, self.horse_history)
+            for person_type in ("driver", "trainer"):
+                if self.person_history[person_type]:
+                    cursor.executemany(SQL_INSERT_PERSON_HISTORY[person_type], self.person_history[person_type])
+            cursor.execute("COMMIT")
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+        self.race_entries.clear()
+        self.horse_history.clear()
+        for buf in self.person_history.values():
+            buf.clear()
+        for buf in self.rating_updates.values():
+            buf.clear()
+
+
+def add_horse(db_name: str, player_name: str, race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None) -> None:
+    """
+    Add a new horse with default Mu, Sigma, and set last_played (date) and last_track (track name).
+    """
+    race_date_val = race_date if race_date else datetime.datetime.now()
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR IGNORE INTO player_ratings (player_name, mu, sigma, last_played, last_track)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (player_name, DEFAULT_MU, DEFAULT_SIGMA, race_date_val, race_track))
+        conn.commit()
+
+
+def add_person(db_name: str, person_name: str, person_type: str, race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None) -> None:
+    """
+    Add a new driver or trainer with default Mu, Sigma.
+    person_type should be either "driver" or "trainer"
+    """
+    table_name = f"{person_type}_ratings"
+    date_field = "last_raced"
+    name_field = f"{person_type}_name"
+    
+    race_date_val = race_date if race_date else datetime.datetime.now()
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        query = f'''
+            INSERT OR IGNORE INTO {table_name} ({name_field}, mu, sigma, {date_field}, last_track)
+            VALUES (?, ?, ?, ?, ?)
+        '''
+        cursor.execute(query, (person_name, DEFAULT_MU, DEFAULT_SIGMA, race_date_val, race_track))
+        conn.commit()
+
+
+class RatingCache:
+    """
+    Per-race cache of raw rating rows, bulk-loaded in one query per table.
+
+    get_player_rating/get_person_rating otherwise issue one SELECT per
+    competitor — ~3N round trips per race. preload() pulls every name on
+    the card with a single IN (...) query per table, and the getters answer
+    from the cache, including definitive "not in the DB" answers for names
+    that were preloaded but absent.
+    """
+
+    def __init__(self, db_name: str):
+        self.db_name = db_name
+        self.horses: Dict[str, tuple] = {}
+        self.persons: Dict[str, Dict[str, tuple]] = {"driver": {}, "trainer": {}}
+        self.horse_known: set = set()
+        self.person_known: Dict[str, set] = {"driver": set(), "trainer": set()}
+
+    def preload(self, horse_names: List[str], driver_names: List[Optional[str]],
+                trainer_names: List[Optional[str]]) -> None:
+        cursor = get_conn(self.db_name).cursor()
+        names = sorted({n for n in horse_names if n})
+        if names:
+            placeholders = ",".join("?" * len(names))
+            cursor.execute(f'SELECT player_name, mu, sigma, last_played FROM player_ratings WHERE player_name IN ({placeholders})', names)
+            for name, mu, sigma, last_played in cursor.fetchall():
+                self.horses[name] = (mu, sigma, last_played)
+            self.horse_known.update(names)
+        for person_type, pool in (("driver", driver_names), ("trainer", trainer_names)):
+            names = sorted({n for n in pool if n})
+            if not names:
+                continue
+            placeholders = ",".join("?" * len(names))
+            cursor.execute(f'SELECT {person_type}_name, mu, sigma, last_raced FROM {person_type}_ratings WHERE {person_type}_name IN ({placeholders})', names)
+            for name, mu, sigma, last_raced in cursor.fetchall():
+                self.persons[person_type][name] = (mu, sigma, last_raced)
+            self.person_known[person_type].update(names)
+
+    # Write-through hooks so rows added mid-race stay answerable from cache
+    def store_horse(self, name: str, mu: float, sigma: float, last_played) -> None:
+        self.horses[name] = (mu, sigma, last_played)
+        self.horse_known.add(name)
+
+    def store_person(self, person_type: str, name: str, mu: float, sigma: float, last_raced) -> None:
+        self.persons[person_type][name] = (mu, sigma, last_raced)
+        self.person_known[person_type].add(name)
+
+
+def get_player_rating(db_name: str, player_name: str, race_date: Optional[datetime.datetime] = None,
+                      cache: Optional[RatingCache] = None
+                     ) -> Tuple[Optional[trueskill.Rating], Optional[str]]:
+    """
+    Fetch a horse's current rating and last_played date from the DB.
+    Applies log-based decay if a last_played timestamp exists.
+    A preloaded RatingCache answers without a round trip.
+    """
+    if cache is not None and player_name in cache.horse_known:
+        result = cache.horses.get(player_name)
+    else:
+        with get_conn(db_name) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT mu, sigma, last_played FROM player_ratings WHERE player_name=?', (player_name,))
+            result = cursor.fetchone()
+
+    if result:
+        mu, sigma, last_played_str = result
+        # Decay on the raw floats and build the Rating once at return.
+        if last_played_str:
+            last_played_dt = _parse_dt(last_played_str)
+            if last_played_dt is None:
+                logging.error(f"Time data {last_played_str!r} for player {player_name} does not match any expected format. Skipping decay.")
+                return trueskill.Rating(mu=mu, sigma=sigma), last_played_str
+
+            current_dt = race_date if race_date else datetime.datetime.now()
+            days_since_last = (current_dt - last_played_dt).days
+            mu = calculate_rating_decay(mu, days_since_last)
+        return trueskill.Rating(mu=mu, sigma=sigma), last_played_str
+    else:
+        return None, None
+
+
+def get_person_rating(db_name: str, person_name: str, person_type: str, race_date: Optional[datetime.datetime] = None,
+                      cache: Optional[RatingCache] = None
+                     ) -> Optional[trueskill.Rating]:
+    """
+    Fetch a driver's or trainer's rating and apply decay.
+    person_type should be either "driver" or "trainer"
+    A preloaded RatingCache answers without a round trip.
+    """
+    if not person_name:
+        return None
+
+    if cache is not None and person_name in cache.person_known[person_type]:
+        result = cache.persons[person_type].get(person_name)
+    else:
+        table_name = f"{person_type}_ratings"
+        date_field = "last_raced"
+        name_field = f"{person_type}_name"
+
+        with get_conn(db_name) as conn:
+            cursor = conn.cursor()
+            query = f'SELECT mu, sigma, {date_field} FROM {table_name} WHERE {name_field}=?'
+            cursor.execute(query, (person_name,))
+            result = cursor.fetchone()
+    
+    if result:
+        mu, sigma, last_played_str = result
+        # Apply decay on the raw floats; build the Rating once at return
+        if last_played_str:
+            last_played_dt = _parse_dt(last_played_str)
+            if last_played_dt is None:
+                logging.error(f"Time data {last_played_str!r} for {person_type} {person_name} does not match any expected format. Skipping decay.")
+                return trueskill.Rating(mu=mu, sigma=sigma)
+
+            current_dt = race_date if race_date else datetime.datetime.now()
+            days_since_last = (current_dt - last_played_dt).days
+            mu = calculate_rating_decay(mu, days_since_last)
+
+        return trueskill.Rating(mu=mu, sigma=sigma)
+    else:
+        return None
+
+
+def update_player_rating(db_name: str, player_name: str, new_rating: trueskill.Rating,
+                         race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None,
+                         writer: Optional[RaceWriter] = None) -> None:
+    """
+    Store the updated rating (Mu, Sigma), last_played (date), and last_track (track name)
+    in the player_ratings table. With a writer, the row is enqueued for the
+    batched flush instead of committed immediately.
+    """
+    last_played_date = race_date if race_date else datetime.datetime.now()
+    if writer is not None:
+        writer.queue_rating_update("player", (player_name, new_rating.mu, new_rating.sigma, last_played_date, race_track))
+        return
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO player_ratings (player_name, mu, sigma, last_played, last_track)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(player_name) DO UPDATE SET
+                mu = excluded.mu, sigma = excluded.sigma,
+                last_played = excluded.last_played, last_track = excluded.last_track
+        ''', (player_name, new_rating.mu, new_rating.sigma, last_played_date, race_track))
+        conn.commit()
+
+
+def update_person_rating(db_name: str, person_name: str, person_type: str, new_rating: trueskill.Rating,
+                        race_date: Optional[datetime.datetime] = None, race_track: Optional[str] = None,
+                        writer: Optional[RaceWriter] = None) -> None:
+    """
+    Store the updated rating for a driver or trainer.
+    person_type should be either "driver" or "trainer"
+    """
+    table_name = f"{person_type}_ratings"
+    date_field = "last_raced"
+    name_field = f"{person_type}_name"
+
+    race_date_val = race_date if race_date else datetime.datetime.now()
+    if writer is not None:
+        writer.queue_rating_update(person_type, (person_name, new_rating.mu, new_rating.sigma, race_date_val, race_track))
+        return
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        query = f'''
+            INSERT INTO {table_name} ({name_field}, mu, sigma, {date_field}, last_track)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT({name_field}) DO UPDATE SET
+                mu = excluded.mu, sigma = excluded.sigma,
+                {date_field} = excluded.{date_field}, last_track = excluded.last_track
+        '''
+        cursor.execute(query, (person_name, new_rating.mu, new_rating.sigma, race_date_val, race_track))
+        conn.commit()
+
+
+def log_horse_race(db_name: str, player_name: str, mu: float, sigma: float,
+                   race_date: Optional[datetime.datetime] = None,
+                   race_track: Optional[str] = None,
+                   finish_position: Optional[str] = None,
+                   race_class: Optional[str] = None,
+                   writer: Optional[RaceWriter] = None) -> None:
+    """Log a horse's race result to the history table."""
+    race_date_val = race_date if race_date else datetime.datetime.now()
+    if writer is not None:
+        writer.queue_history("horse", (player_name, mu, sigma, race_date_val, race_track, finish_position, race_class))
+        return
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO horse_history (player_name, mu, sigma, race_date, last_track, finish_position, race_class)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (player_name, mu, sigma, race_date_val, race_track, finish_position, race_class))
+        conn.commit()
+
+
+def log_person_race(db_name: str, person_name: str, person_type: str, mu: float, sigma: float,
+                   race_date: Optional[datetime.datetime] = None,
+                   race_track: Optional[str] = None,
+                   horse_name: Optional[str] = None,
+                   finish_position: Optional[str] = None,
+                   race_class: Optional[str] = None,
+                   writer: Optional[RaceWriter] = None) -> None:
+    """
+    Log a driver's or trainer's race result to the history table.
+    person_type should be either "driver" or "trainer"
+    """
+    table_name = f"{person_type}_history"
+    name_field = f"{person_type}_name"
+
+    race_date_val = race_date if race_date else datetime.datetime.now()
+    if writer is not None:
+        writer.queue_history(person_type, (person_name, mu, sigma, race_date_val, race_track,
+                                           horse_name, finish_position, race_class))
+        return
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        query = f'''
+            INSERT INTO {table_name} 
+            ({name_field}, mu, sigma, race_date, last_track, horse_name, finish_position, race_class)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        '''
+        cursor.execute(query, (person_name, mu, sigma, race_date_val, race_track, 
+                               horse_name, finish_position, race_class))
+        conn.commit()
+
+
+def store_race_entry(db_name: str, race_date: datetime.datetime, track: str, race_number: int,
+                    horse_name: str, driver_name: Optional[str], trainer_name: Optional[str],
+                    finish_position: Optional[str], race_class: Optional[str],
+                    gait: str, is_qualifier: bool,
+                    writer: Optional[RaceWriter] = None) -> None:
+    """
+    Store complete race entry information.
+    """
+    if writer is not None:
+        writer.queue_race_entry((race_date, track, race_number, horse_name, driver_name,
+                                 trainer_name, finish_position, race_class, gait, is_qualifier))
+        return
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO race_entries
+            (race_date, track, race_number, horse_name, driver_name, trainer_name, 
+             finish_position, race_class, gait, is_qualifier)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (race_date, track, race_number, horse_name, driver_name, trainer_name, 
+              finish_position, race_class, gait, is_qualifier))
+        conn.commit()
+
+
+def _install_dry_run_stubs() -> None:
+    """
+    Swap the mutating functions for logging no-ops.
+
+    Called once after CLI parsing when --dry-run is set, so in normal runs
+    the write paths carry no per-call DRY_RUN branch or global lookup.
+    """
+    def dry(message=None):
+        def decorate(func):
+            @functools.wraps(func)
+            def stub(*args, **kwargs):
+                if message is not None:
+                    logging.info(message(*args, **kwargs))
+            return stub
+        return decorate
+
+    g = globals()
+    g["add_horse"] = dry(
+        lambda db_name, player_name, *a, **k:
+        f"DRY RUN: Would add horse '{player_name}' to {db_name}.db")(add_horse)
+    g["add_person"] = dry(
+        lambda db_name, person_name, person_type, *a, **k:
+        f"DRY RUN: Would add {person_type} '{person_name}' to {db_name}.db")(add_person)
+    g["update_player_rating"] = dry(
+        lambda db_name, player_name, new_rating, *a, **k:
+        f"DRY RUN: Would update horse '{player_name}' in {db_name}.db to mu={new_rating.mu:.2f}, sigma={new_rating.sigma:.2f}")(update_player_rating)
+    g["update_person_rating"] = dry(
+        lambda db_name, person_name, person_type, new_rating, *a, **k:
+        f"DRY RUN: Would update {person_type} '{person_name}' in {db_name}.db to mu={new_rating.mu:.2f}, sigma={new_rating.sigma:.2f}")(update_person_rating)
+    g["log_horse_race"] = dry()(log_horse_race)
+    g["log_person_race"] = dry()(log_person_race)
+    g["store_race_entry"] = dry()(store_race_entry)
+
+
+def _build_decay_table() -> List[float]:
+    """Precompute the log-decay factor for every whole day up to the cap."""
+    max_x = (MAX_DAYS_DECAY - MIN_DAYS_NO_DECAY) + 1
+    if max_x <= 1:
+        return [1.0] * (MAX_DAYS_DECAY + 1)
+    log_max = math.log(max_x)
+    factors = []
+    for d in range(MAX_DAYS_DECAY + 1):
+        if d <= MIN_DAYS_NO_DECAY:
+            factors.append(1.0)
+        else:
+            x = max(1, (d - MIN_DAYS_NO_DECAY) + 1)
+            factors.append(1 - (math.log(x) / log_max) * MAX_DECAY)
+    return factors
+
+
+# The decay curve depends only on the (small, bounded) integer day count,
+# so the two math.log calls per rating fetch collapse into a table lookup.
+_DECAY_FACTOR = _build_decay_table()
+
+
+def calculate_rating_decay(mu: float, days_since_last_played: int) -> float:
+     """
+     Apply a log-based decay to a rating value.
+     - No decay if <= MIN_DAYS_NO_DECAY days.
+     - Gradually decays up to MAX_DECAY at MAX_DAYS_DECAY days.
+     """
+     if days_since_last_played <= MIN_DAYS_NO_DECAY:
+         return mu
+     return mu * _DECAY_FACTOR[min(days_since_last_played, MAX_DAYS_DECAY)]
+
+
+_DECAY_FACTOR_ARR = np.asarray(_DECAY_FACTOR)
+
+# 1 / sqrt(2 * pi), for the inline standard-normal pdf in the rating kernel
+_INV_SQRT_2PI = 0.3989422804014327
+
+
+def calculate_rating_decay_vec(mus: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """
+    Vectorized calculate_rating_decay for a whole field at once.
+    Used by the bulk competitor queries, where applying decay row-by-row
+    in Python would dominate the fetch.
+    """
+    days = np.clip(np.asarray(days, dtype=np.int64), 0, MAX_DAYS_DECAY)
+    return np.asarray(mus, dtype=np.float64) * _DECAY_FACTOR_ARR[days]
+
+
+def combined_rating_vec(horse_mu: np.ndarray, driver_mu: np.ndarray, trainer_mu: np.ndarray,
+                        has_driver: np.ndarray, has_trainer: np.ndarray) -> np.ndarray:
+    """
+    Weighted mu blend for a whole field, using the same adaptive weights
+    as calculate_adaptive_weights, selected per row with np.where.
+    """
+    has_driver = np.asarray(has_driver, dtype=bool)
+    has_trainer = np.asarray(has_trainer, dtype=bool)
+    both = has_driver & has_trainer
+    w_horse = np.where(both, HORSE_WEIGHT,
+                       np.where(has_driver, 0.7, np.where(has_trainer, 0.8, 1.0)))
+    w_driver = np.where(both, DRIVER_WEIGHT, np.where(has_driver, 0.3, 0.0))
+    w_trainer = np.where(both, TRAINER_WEIGHT, np.where(has_trainer, 0.2, 0.0))
+    return (np.asarray(horse_mu, dtype=np.float64) * w_horse
+            + np.asarray(driver_mu, dtype=np.float64) * w_driver
+            + np.asarray(trainer_mu, dtype=np.float64) * w_trainer)
+
+
+def fast_rate_single_player_teams(mus: np.ndarray, sigmas: np.ndarray, ranks: np.ndarray,
+                                  beta: float = DEFAULT_SIGMA / 2,
+                                  tau: float = DEFAULT_SIGMA / 100) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized TrueSkill update for a race of single-player teams.
+
+    Implements the Weng-Lin (2011) Thurstone-Mosteller full-pairing
+    approximation: every pairwise comparison contributes one Gaussian
+    truncation update, evaluated over NumPy arrays in a handful of C
+    calls instead of trueskill's per-race factor graph. Exact for two
+    runners and within noise of trueskill.rate for typical field sizes.
+    """
+    from scipy.special import ndtr  # optional dependency; callers fall back
+
+    mus = np.asarray(mus, dtype=np.float64)
+    sigmas = np.asarray(sigmas, dtype=np.float64)
+    ranks = np.asarray(ranks, dtype=np.int64)
+
+    sig2 = sigmas * sigmas + tau * tau  # additive dynamics, as in trueskill
+    c2 = sig2[:, None] + sig2[None, :] + 2.0 * beta * beta
+    c = np.sqrt(c2)
+    delta = (mus[:, None] - mus[None, :]) / c
+    # +1 where row i beat column j, -1 where it lost, 0 for dead heats
+    s = np.sign(ranks[None, :] - ranks[:, None]).astype(np.float64)
+
+    t = s * delta
+    # Raw ufunc plus inline standard-normal pdf: no scipy.stats frozen
+    # distribution or argument validation in the inner math.
+    cdf = ndtr(t)
+    pdf = _INV_SQRT_2PI * np.exp(-0.5 * t * t)
+    tiny = np.finfo(np.float64).tiny
+    v_win = pdf / np.maximum(cdf, tiny)
+    w_win = v_win * (v_win + t)
+
+    # Dead heats use the zero-margin draw limits: v = -delta, w = 1
+    tie = (s == 0.0)
+    v = np.where(tie, -delta, s * v_win)
+    w = np.where(tie, 1.0, w_win)
+    np.fill_diagonal(v, 0.0)
+    np.fill_diagonal(w, 0.0)
+
+    omega = sig2 * np.sum(v / c, axis=1)
+    eta = np.sum((sigmas[:, None] / c) * (sig2[:, None] / c2) * w, axis=1)
+
+    new_sig2 = sig2 * np.maximum(1.0 - eta, 1e-4)
+    return mus + omega, np.sqrt(new_sig2)
+
+
+def fetch_and_decay_rating(db_name: str, player_name: str,
+                           race_date: Optional[datetime.datetime] = None,
+                           race_track: Optional[str] = None,
+                           cache: Optional[RatingCache] = None) -> trueskill.Rating:
+    """
+    Retrieve a horse's rating, apply decay if needed, and return the decayed rating.
+    If the horse doesn't exist, add it with a default rating, including the track.
+    """
+    rating, _ = get_player_rating(db_name, player_name, race_date, cache=cache)
+    if rating is None:
+        add_horse(db_name, player_name, race_date, race_track)
+        if cache is not None:
+            cache.store_horse(player_name, DEFAULT_MU, DEFAULT_SIGMA, None)
+        rating = DEFAULT_RATING
+    return rating
+
+
+def fetch_and_decay_person_rating(db_name: str, person_name: str, person_type: str,
+                                 race_date: Optional[datetime.datetime] = None,
+                                 race_track: Optional[str] = None,
+                                 cache: Optional[RatingCache] = None) -> trueskill.Rating:
+    """
+    Retrieve a driver or trainer rating, apply decay if needed.
+    If the person doesn't exist, add them with a default rating.
+    person_type should be either "driver" or "trainer"
+    """
+    if not person_name:
+        return DEFAULT_RATING
+
+    rating = get_person_rating(db_name, person_name, person_type, race_date, cache=cache)
+    if rating is None:
+        add_person(db_name, person_name, person_type, race_date, race_track)
+        if cache is not None:
+            cache.store_person(person_type, person_name, DEFAULT_MU, DEFAULT_SIGMA, None)
+        rating = DEFAULT_RATING
+    return rating
+
+
+def calculate_adaptive_weights(has_driver: bool, has_trainer: bool) -> Dict[str, float]:
+    """
+    Calculate adaptive weights for horse, driver, and trainer
+    based on what data is available.
+    """
+    if has_driver and has_trainer:
+        # Complete data
+        return {
+            "horse": HORSE_WEIGHT,
+            "driver": DRIVER_WEIGHT,
+            "trainer": TRAINER_WEIGHT
+        }
+    elif has_driver and not has_trainer:
+        # No trainer data
+        return {
+            "horse": 0.7,
+            "driver": 0.3,
+            "trainer": 0.0
+        }
+    elif has_trainer and not has_driver:
+        # No driver data
+        return {
+            "horse": 0.8,
+            "driver": 0.0,
+            "trainer": 0.2
+        }
+    else:
+        # Only horse data
+        return {
+            "horse": 1.0,
+            "driver": 0.0,
+            "trainer": 0.0
+        }
+
+
+def get_combined_rating(db_name: str, horse_name: str, driver_name: Optional[str], trainer_name: Optional[str], 
+                        race_date: Optional[datetime.datetime] = None) -> trueskill.Rating:
+    """
+    Calculate a combined rating based on horse, driver, and trainer ratings.
+    Applies weighted average to mu and sigma values.
+    """
+    # Get individual ratings
+    horse_rating, _ = get_player_rating(db_name, horse_name, race_date)
+    if horse_rating is None:
+        horse_rating = DEFAULT_RATING
+    
+    driver_rating = None
+    if driver_name:
+        driver_rating = get_person_rating(db_name, driver_name, "driver", race_date)
+    if driver_rating is None:
+        driver_rating = DEFAULT_RATING
+    
+    trainer_rating = None
+    if trainer_name:
+        trainer_rating = get_person_rating(db_name, trainer_name, "trainer", race_date)
+    if trainer_rating is None:
+        trainer_rating = DEFAULT_RATING
+    
+    # Get adaptive weights based on available data
+    weights = calculate_adaptive_weights(driver_name is not None, trainer_name is not None)
+    
+    # Calculate weighted mu and sigma
+    combined_mu = (horse_rating.mu * weights["horse"] + 
+                   driver_rating.mu * weights["driver"] + 
+                   trainer_rating.mu * weights["trainer"])
+    
+    # For sigma, we use a weighted average of the sigmas
+    combined_sigma = (horse_rating.sigma * weights["horse"] + 
+                      driver_rating.sigma * weights["driver"] + 
+                      trainer_rating.sigma * weights["trainer"])
+    
+    return trueskill.Rating(mu=combined_mu, sigma=combined_sigma)
+
+
+def get_competitors_in_race(db_name: str, race_date: datetime.datetime, race_track: str, 
+                           race_number: int, person_type: str) -> List[Tuple[str, trueskill.Rating]]:
+    """
+    Get all drivers or trainers competing in a specific race.
+    Returns a list of (name, rating) tuples.
+    """
+    # One JOIN instead of one SELECT per competitor; decay is applied to
+    # the whole field in a single vectorized pass.
+    with get_conn(db_name) as conn:
+        cursor = conn.cursor()
+        query = f'''
+            SELECT re.{person_type}_name, r.mu, r.sigma, r.last_raced
+            FROM race_entries re
+            LEFT JOIN {person_type}_ratings r ON r.{person_type}_name = re.{person_type}_name
+            WHERE re.race_date = ? AND re.track = ? AND re.race_number = ?
+              AND re.{person_type}_name IS NOT NULL
+        '''
+        cursor.execute(query, (race_date, race_track, race_number))
+        rows = cursor.fetchall()
+
+    current_dt = race_date if race_date else datetime.datetime.now()
+    existing = []
+    missing = []
+    for name, mu, sigma, last_raced in rows:
+        if mu is None:
+            missing.append(name)
+        else:
+            days = 0
+            if last_raced:
+                last_raced_dt = _parse_dt(last_raced)
+                if last_raced_dt is not None:
+                    days = (current_dt - last_raced_dt).days
+            existing.append((name, mu, sigma, days))
+
+    ratings = {name: DEFAULT_RATING for name in missing}
+    if existing:
+        decayed_mus = calculate_rating_decay_vec([e[1] for e in existing],
+                                                 [e[3] for e in existing])
+        for (name, _, sigma, _), decayed_mu in zip(existing, decayed_mus):
+            ratings[name] = trueskill.Rating(mu=float(decayed_mu), sigma=sigma)
+
+    # Competitors not yet in the ratings table get their default row in one
+    # batch rather than an insert apiece.
+    if missing and not DRY_RUN:
+        race_date_val = race_date if race_date else datetime.datetime.now()
+        with get_conn(db_name) as conn:
+            conn.executemany(f'''
+                INSERT OR IGNORE INTO {person_type}_ratings ({person_type}_name, mu, sigma, last_raced, last_track)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(name, DEFAULT_MU, DEFAULT_SIGMA, race_date_val, race_track) for name in set(missing)])
+
+    return [(name, ratings[name]) for name, _, _, _ in rows]
+
+
+# -------------------------------------------------------------------------------------
+# Parsing Functions Module
+# -------------------------------------------------------------------------------------
+def parse_finish(token: str) -> Optional[int]:
+    """Extract the numeric finish position from a finish token."""
+    if not token: return None
+    if "/" in token:
+        parts = token.split("/")
+        for part in parts:
+            num_str = part.translate(_NONDIGIT_TABLE)
+            if num_str:
+                try: return int(num_str)
+                except ValueError: continue
+        return None
+    else:
+        try: return int(token.translate(_NONDIGIT_TABLE))
+        except ValueError: return None
+
+
+def _has_alpha(s: str) -> bool:
+    """True if s contains a lowercase ASCII letter; names are already
+    lowercased, and for ~15-char strings this beats the regex engine."""
+    return any('a' <= c <= 'z' for c in s)
+
+
+def parse_horse_line(tokens: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Parse a line of horse data including driver and trainer info with improved name handling.
+    Better handles names with prefixes (Mc, Mac, Van, etc.) and suffixes (Jr, Sr, etc.).
+    """
+    if not tokens:
+        return None
+
+    # Extract basic horse info (same as before)
+    hn = tokens[0]
+    # Bound pattern methods: skips the re-module dispatch and attribute
+    # lookups inside the token loops below.
+    _break_match = RE_BREAK.fullmatch
+    _odds_match = RE_ODDS.match
+    name_tokens = []
+    i = 1
+    while i < len(tokens) and not (tokens[i].isdigit() or tokens[i].upper().startswith("SCR")):
+        # Skip break indicators like "x4", "x5x", etc.
+        if _break_match(tokens[i]):
+            i += 1
+            continue
+        token_clean = tokens[i].translate(_NONALPHA_TABLE)
+        if (len(token_clean) > 1 and token_clean.isalpha()) or (len(token_clean) == 1 and token_clean.upper() in ALLOWED_SIGNIFIERS):
+            name_tokens.append(tokens[i])
+        i += 1
+    horse_name = " ".join(name_tokens).lower() if name_tokens else None
+
+    if i >= len(tokens) or not horse_name:
+        return None
+        
+    pp = tokens[i]
+    pp_clean = pp.translate(_X_TABLE).strip(".,;:-")
+    is_scratched = (pp_clean.upper() == "SCR")
+    i += 1
+
+    # Process finish position and odds (same as before)
+    # Cheap len/first-char gates reject name and money tokens before the
+    # regex engine even starts; the shortest odds token ('0.00') is 4 chars.
+    odds_index = next((idx for idx, t in enumerate(tokens)
+                       if len(t) > 3 and (t[0] == '*' or t[0].isdigit()) and _odds_match(t)),
+                      None)
+    odds = tokens[odds_index] if odds_index is not None else None
+
+    # ... rest of finish position code (unchanged) ...
+    finish_candidate = None
+    if odds_index is not None:
+        start_idx = max(0, odds_index - 6)
+        window = tokens[start_idx:odds_index]
+        for j in range(len(window) - 1, 0, -1):
+            if "/" in window[j]:
+                finish_candidate = window[j - 1]
+                break
+
+    if finish_candidate is None and odds_index is not None:
+        window = tokens[max(0, odds_index - 6):odds_index]
+        for token in reversed(window):
+            token_clean = token.translate(_X_TABLE).strip(".,;:-")
+            if token_clean.isdigit():
+                finish_candidate = token_clean
+                break
+
+    if odds_index is None and i + 4 < len(tokens):
+        finish_candidate = tokens[i+4]
+        i += 5
+
+    if finish_candidate is not None:
+        finish_candidate = finish_candidate.translate(_X_TABLE).strip(".,;:-")
+
+    if finish_candidate is None:
+        finish = None
+    elif finish_candidate.upper() == "DNF":
+        finish = "DNF"
+    elif "/" in finish_candidate:
+        m = RE_FINISH_DIGITS.match(finish_candidate)
+        finish = int(m.group(1)) if m else None
+    else:
+        m = RE_FINISH_DIGITS.match(finish_candidate)
+        finish = int(m.group(1)) if m else None
+
+    if is_scratched:
+        finish = None
+
+    # Improved driver and trainer name extraction
+    driver_name = None
+    trainer_name = None
+    
+    # Find earnings token (typically starts with $)
+    earnings_idx = next(
+        (i for i, t in enumerate(tokens) if t.startswith('$') and len(t) > 1 and t[1].isdigit()),
+        None
+    )
+    
+    # Classify every token once up front. extract_full_name revisits the
+    # same indices across the driver, trainer and fallback passes, so a
+    # per-line bitmap avoids re-running the name-like checks each time.
+    # Names should have letters, not be purely numeric or money values.
+    _name_like = [bool(RE_NAMELIKE.search(t)) and not t.startswith('$') and not t.isdigit()
+                  for t in tokens]
+
+    # Extended name extraction with smarter handling of prefixes/suffixes
+    def extract_full_name(start_idx, max_tokens=4):  # Increased max_tokens to handle longer names
+        if start_idx >= len(tokens):
+            return None, 0
+            
+        name_parts = []
+        curr_idx = start_idx
+        token_count = 0
+        
+        # Get first part of the name, lowercased once on append
+        if curr_idx < len(tokens) and _name_like[curr_idx]:
+            name_parts.append(tokens[curr_idx].lower())
+            curr_idx += 1
+            token_count += 1
+        else:
+            return None, 0
+            
+        # Handle last name, potentially with prefix
+        if curr_idx < len(tokens) and _name_like[curr_idx]:
+            # Check if this might be a name prefix (Mc, Mac, etc.)
+            prefix_detected = False
+            prev_lower = tokens[curr_idx - 1].lower()
+            if prev_lower.rstrip('.') in _NAME_PREFIXES or prev_lower.endswith('mc'):
+                if curr_idx + 1 < len(tokens) and _name_like[curr_idx + 1]:
+                    # We likely have a situation like "Ed Mc Neight Jr" - add both parts
+                    name_parts.append(tokens[curr_idx].lower())  # Add "Neight"
+                    curr_idx += 1
+                    token_count += 1
+                    prefix_detected = True
+            
+            if not prefix_detected:
+                name_parts.append(tokens[curr_idx].lower())  # Add last name
+                curr_idx += 1
+                token_count += 1
+                
+        # Check for a suffix (Jr, Sr, etc.)
+        if curr_idx < len(tokens) and token_count < max_tokens:
+            if tokens[curr_idx].lower().rstrip('.') in _NAME_SUFFIXES:
+                name_parts.append(tokens[curr_idx].lower())  # Add suffix
+                curr_idx += 1
+                token_count += 1
+                
+        return " ".join(name_parts) if name_parts else None, token_count
+    
+    # Look between earnings and odds (most common pattern)
+    if earnings_idx is not None and odds_index is not None and odds_index > earnings_idx + 1:
+        # We have a pattern like: $earnings driver_name trainer_name odds
+        curr_idx = earnings_idx + 1
+        
+        # Try to extract driver name
+        driver_name, tokens_used = extract_full_name(curr_idx)
+        curr_idx += tokens_used
+        
+        # Try to extract trainer name if we have more tokens
+        if curr_idx < odds_index:
+            trainer_name, _ = extract_full_name(curr_idx)
+    
+    # If we still don't have names, try explicit markers
+    if not driver_name or not trainer_name:
+        for idx, token in enumerate(tokens):
+            if idx < len(tokens) - 1:
+                if token.lower() in DRIVER_MARKERS:
+                    driver_name, _ = extract_full_name(idx + 1)
+                elif token.lower() in TRAINER_MARKERS:
+                    trainer_name, _ = extract_full_name(idx + 1)
+    
+    # One last attempt - look after odds
+    if (not driver_name or not trainer_name) and odds_index is not None and odds_index + 1 < len(tokens):
+        if not driver_name:
+            driver_name, tokens_used = extract_full_name(odds_index + 1)
+            if not trainer_name and driver_name and odds_index + 1 + tokens_used < len(tokens):
+                trainer_name, _ = extract_full_name(odds_index + 1 + tokens_used)
+    
+    # Special case handling for common name patterns
+    # This is where we can add specific handling for cases like "Ed Mc Neight Jr"
+    if driver_name and not trainer_name and driver_name.startswith("mc "):
+        # Handle "Mc" prefix specifically if it's at the start
+        parts = driver_name.split()
+        if len(parts) >= 3:  # We have something like "mc neight jr"
+            driver_name = " ".join(parts[:2])  # "mc neight"
+            trainer_name = " ".join(parts[2:])  # "jr" or whatever follows
+    
+    # Validate names - ensure they contain alphabetic characters
+    if driver_name and not _has_alpha(driver_name):
+        driver_name = None
+        
+    if trainer_name and not _has_alpha(trainer_name):
+        trainer_name = None
+        
+    # Additional check for "Mc" names
+    if driver_name and "mc " in driver_name and len(driver_name.split()) >= 2:
+        # Let's make sure we're not cutting off part of a "Mc..." name
+        name_parts = driver_name.split()
+        if len(name_parts) >= 2 and name_parts[0].lower() in ["mc", "mac"]:
+            # We need to examine what's after this position to see if part of name got cut off
+            # This is complex logic that would need custom handling
+            pass
+    
+    # Same check for trainer names
+    if trainer_name and "mc " in trainer_name and len(trainer_name.split()) >= 2:
+        name_parts = trainer_name.split()
+        if len(name_parts) >= 2 and name_parts[0].lower() in ["mc", "mac"]:
+            pass
+    
+    return {
+        "hn": hn,
+        "horse_name": horse_name,
+        "pp": pp_clean,
+        "is_scratched": is_scratched,
+        "finish": finish,
+        "odds": odds,
+        "driver_name": driver_name,
+        "trainer_name": trainer_name
+    }
+    
+def iter_race_contents(txt_file: str):
+    """
+    Yield one preprocessed race-content block at a time from txt_file.
+
+    The file is mapped read-only and sliced per race, so peak memory is
+    one block instead of several whole-file copies.
+    """
+    with open(txt_file, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            starts = [m.start() for m in RE_RACE_BLOCK_B.finditer(mm)]
+            for idx, start in enumerate(starts):
+                end = starts[idx + 1] if idx + 1 < len(starts) else len(mm)
+                block = mm[start:end].decode("utf-8")
+                block = RE_ODDS_SEP.sub(r'\1 \2', block) # Separate odds and letters
+                yield block.replace('\f', '\n').strip()
+
+
+def iter_races_from_contents(contents):
+    """
+    Lazily parse race-content blocks into race dicts, skipping blocks
+    that do not parse. Small batches parse serially in this process;
+    once the batch is big enough to pay for pool startup the blocks are
+    handed to worker processes.
+    """
+    contents = iter(contents)
+    head = list(itertools.islice(contents, PARALLEL_PARSE_THRESHOLD))
+    pool = None
+    if len(head) >= PARALLEL_PARSE_THRESHOLD:
+        try:
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+        except Exception as e:
+            logging.warning(f"Could not start parse pool ({e}); parsing serially.")
+
+    blocks = itertools.chain(head, contents)
+    if pool is None:
+        for content in blocks:
+            race = parse_single_race_content(content)
+            if race:
+                yield race
+    else:
+        with pool:
+            for race in pool.map(parse_single_race_content, blocks, chunksize=4):
+                if race:
+                    yield race
+
+
+def parse_races_from_text(results_text: str) -> List[Dict[str, Any]]:
+    """Parse a block of OCR-extracted text into a list of race dictionaries."""
+    # Pre-processing steps
+    results_text = RE_ODDS_SEP.sub(r'\1 \2', results_text) # Separate odds and letters
+    results_text = results_text.replace('\f', '\n') # Replace form feeds with newlines
+
+    # Split into potential race blocks based on "RACE #"
+    # Using positive lookbehind to keep the delimiter
+    race_blocks_with_labels = RE_RACE_SPLIT.split(results_text)
+
+    # First pass: accumulate the per-race content blocks
+    race_contents = []
+    current_race_content = ""
+
+    for block in race_blocks_with_labels:
+        block = block.strip()
+        if not block: continue
+
+        # Attempt to parse header info from the block
+        m_num = RE_RACE_NUM.search(block)
+        if m_num: # Start of a new race detected
+            # Keep the previous race's content if it exists
+            if current_race_content:
+                race_contents.append(current_race_content)
+
+            # Start accumulating content for the new race
+            current_race_content = block
+        else:
+            # Append content to the current race block
+            current_race_content += "\n" + block
+
+    # Keep the last accumulated race content
+    if current_race_content:
+        race_contents.append(current_race_content)
+
+    return list(iter_races_from_contents(race_contents))
+
+# Helper function to parse content of a single race
+def parse_single_race_content(race_content: str) -> Optional[Dict[str, Any]]:
+    """Parses the accumulated text content for a single race."""
+        # Strip out anything between "Conditions:" and the next "Gait:"
+    race_content = RE_CONDITIONS_GAIT.sub('', race_content)
+
+    m_num = RE_RACE_NUM.search(race_content)
+    if not m_num: return None
+    race_number = int(m_num.group(1))
+
+    gait_match = RE_GAIT.search(race_content)
+    gait_value = GAIT_CANON[gait_match.group(1).lower()] if gait_match else "Unknown" # Default or log warning?
+
+    date_match = RE_DATE_TIME.search(race_content)
+    race_datetime = None
+    if date_match:
+        # Direct part extraction; also accepts the abbreviated month names
+        # RE_DATE_TIME matches, which %B-based strptime silently dropped
+        parts = RE_DATE_PARTS.match(date_match.group(1))
+        month = MONTH_LOOKUP.get(parts.group(1)[:3].title()) if parts else None
+        if month:
+            if parts.group(4):
+                hour = int(parts.group(4)) % 12
+                if parts.group(6) == "PM":
+                    hour += 12
+                minute = int(parts.group(5))
+            else: # If date only, set default time (e.g., noon)
+                hour, minute = 12, 0
+            try:
+                race_datetime = datetime.datetime(int(parts.group(3)), month, int(parts.group(2)), hour, minute)
+            except ValueError:
+                race_datetime = None
+
+    # Attempt to refine time using 'Off:' time if date was found
+    if race_datetime:
+        off_match = RE_OFF.search(race_content)
+        if off_match:
+            off_time_str = off_match.group(1).replace(" ", "") # Remove spaces for parsing
+            # Add PM if missing, assuming races are usually PM
+            if not RE_AMPM.search(off_time_str):
+                off_time_str += "PM"
+            try:
+                hh, mm = off_time_str[:-2].split(":")
+                hour = int(hh) % 12
+                if off_time_str[-2] in "Pp":
+                    hour += 12
+                race_datetime = race_datetime.replace(hour=hour, minute=int(mm), second=0, microsecond=0)
+            except ValueError:
+                 logging.warning(f"Could not parse Off time '{off_match.group(1)}' for Race {race_number}")
+
+
+    # Single alternation scan; map the hit back to the canonical name
+    track_match = RE_KNOWN_TRACK.search(race_content)
+    track_name = TRACK_CANON[track_match.group(1).lower()] if track_match else UNKNOWN_TRACK
+
+    starters_match = RE_STARTERS.search(race_content)
+    starters = int(starters_match.group(2)) if starters_match else None
+
+    # Mark race as qualifier?
+    is_qualifier = bool(RE_PURSE_ZERO.search(race_content) or
+                       RE_QUALIFIER.search(race_content))
+        # Try to extract race class (between "Purse" and "1 Mile"/"Distance")
+    class_match = RE_CLASS.search(race_content)
+    race_class = class_match.group(1).strip() if class_match else None
+
+
+    horses = []
+    lines = race_content.split('\n')
+    table_started = False
+    for line in lines:
+        line_stripped = line.strip()
+        # Lowercase only the 4-char prefix instead of the whole line
+        if not line_stripped or line_stripped[:4].lower() == "http": continue
+
+        # More robust header check, allowing variations
+        if RE_HEADER.search(line_stripped) or "Post" in line_stripped: # Added "Post" as potential indicator
+            table_started = True
+            continue
+
+        if table_started:
+            # More robust end-of-table check
+            if line_stripped.startswith(END_TABLE_PREFIXES) or "Pool:" in line_stripped or "Total:" in line_stripped:
+                break # Stop processing lines for horses
+
+            # Pre-filter on row shape: junk lines between races would
+            # otherwise pay for a parse attempt plus the exception path
+            if not RE_HORSE_ROW.match(line_stripped):
+                continue
+
+            # A stripped line with a double space always yields >= 2 cols,
+            # so the single-space fallback only applies to the else branch,
+            # where str.split runs in C with no regex engine involved.
+            if "  " in line_stripped:
+                cols = RE_MULTI_SPACE.split(line_stripped) # Split on 2+ spaces, might be better
+            else:
+                cols = line_stripped.split()
+                if len(cols) < 5: # Heuristic: need more columns if single space separated
+                    continue
+
+            try:
+                horse_info = parse_horse_line(cols)
+                if horse_info:
+                    # parse_horse_line lowercases every extracted name;
+                    # horse_name_lc aliases it so process_parsed_race can
+                    # read the lowercased name without re-lowering. Driver
+                    # and trainer consumers read the plain keys directly.
+                    horses.append({
+                        "horse_name": horse_info["horse_name"], # Already stripped in parse_horse_line
+                        "horse_name_lc": horse_info["horse_name"],
+                        "finish": horse_info["finish"],
+                        "odds": horse_info["odds"],
+                        "is_scratched": horse_info["is_scratched"],
+                        "driver_name": horse_info.get("driver_name"),  # Add driver name
+                        "trainer_name": horse_info.get("trainer_name")  # Add trainer name
+                    })
+            except Exception as e:
+                 logging.error(f"Error parsing line in Race {race_number}: '{line_stripped}'. Error: {e}")
+                 continue # Skip problematic lines
+
+    # Only return race if horses were found
+    if not horses:
+        return None
+
+    return {
+        "race_number": race_number,
+        "date": race_datetime,
+        "track": track_name,
+        "gait": gait_value,
+        "horses": horses,
+        "is_qualifier": is_qualifier,
+        "starters": starters, # May be None
+        "race_class": race_class
+
+    }
+
+# -------------------------------------------------------------------------------------
+# TrueSkill Processing Module
+# -------------------------------------------------------------------------------------
+def process_parsed_race(race: Dict[str, Any]) -> None:
+    """
+    Process a single race: determines DB, fetches/decays ratings, updates ratings using TrueSkill,
+    and logs results. Handles qualifiers by only updating last_played/last_track.
+    Now handles drivers and trainers as well as horses.
+    """
+    # Basic validation of the race dictionary
+    if not all(k in race for k in ["gait", "horses", "date", "track", "race_number"]):
+        logging.error(f"Skipping incomplete race data: {race.get('race_number', 'Unknown')}")
+        return
+
+    gait_value = race["gait"].strip().lower()
+    # Allow for "Galt" -> "Trot" correction
+    if gait_value.startswith("galt"):
+        gait_value = "trot"
+    race["gait"] = gait_value # Update dict if corrected
+
+    # Bind the hot dict fields to locals once; the loops below read
+    # these dozens of times per race.
+    race_number = race["race_number"]
+    race_horses = race["horses"]
+    race_class = race.get("race_class")
+    is_qualifier = race.get("is_qualifier", False)
+
+    # Determine database name
+    db_name = "trotters" if gait_value == "trot" else "pacers"
+    # Initialize DB (creates tables/columns if needed) - safe to call repeatedly
+    init_db(db_name)
+
+    # Filter out scratched horses and those without a valid integer finish position
+    valid_horses = [h for h in race_horses if not h.get("is_scratched", False) and isinstance(h.get("finish"), int)]
+
+    if len(valid_horses) < 2:
+        logging.warning(f"Race {race_number} at {race.get('track')} has less than 2 valid finishers. Skipping rating update.")
+        # Optionally, still update last_played/last_track for all participants?
+        # Decide if even single finishers should have their date/track updated.
+        # For now, we just skip the whole race if < 2 finishers.
+        return
+
+    # Sort by finish position for TrueSkill ranks
+    sorted_horses = sorted(valid_horses, key=lambda x: x["finish"])
+    horse_names = [h["horse_name_lc"] for h in sorted_horses] # Lowercased once at parse time
+    race_date = race["date"]
+    if race_date is None:
+        # One timestamp for the whole race; otherwise every write helper
+        # falls back to its own datetime.now() syscall.
+        race_date = datetime.datetime.now()
+    race_track = race["track"] # Get track name
+
+    # One writer per race: every row below is enqueued and flushed in a
+    # single transaction instead of one commit per row.
+    writer = RaceWriter(db_name)
+
+    # One bulk SELECT per table for everyone on the card, so the rating
+    # fetches below are dict hits instead of per-competitor round trips.
+    cache = RatingCache(db_name)
+    cache.preload(
+        horse_names=[h["horse_name_lc"] for h in race_horses if h.get("horse_name")],
+        driver_names=[h.get("driver_name") for h in race_horses],
+        trainer_names=[h.get("trainer_name") for h in race_horses],
+    )
+
+    # Handle Qualifier Races - No Rating Change, Just Update Activity
+    if is_qualifier:
+        logging.info(f"Processing Qualifier Race {race_number} at {race_track}. Updating last played/track only.")
+        for horse_info in race_horses:
+            if horse_info.get("is_scratched"): continue # Skip scratched
+
+            horse_name = horse_info["horse_name_lc"]
+            # Fetch current rating just to pass to update function (mu/sigma won't change)
+            rating, _ = get_player_rating(db_name, horse_name, race_date, cache=cache)
+            if rating:
+                # Update last_played date and last_track name
+                update_player_rating(db_name, horse_name, rating, race_date, race_track, writer=writer)
+            else:
+                # Add horse if new, setting last_played and last_track
+                add_horse(db_name, horse_name, race_date, race_track)
+                
+            # Update last_played for driver if available
+            driver_name = horse_info.get("driver_name")
+            if driver_name:
+                driver_rating = get_person_rating(db_name, driver_name, "driver", race_date, cache=cache)
+                if driver_rating:
+                    update_person_rating(db_name, driver_name, "driver", driver_rating, race_date, race_track, writer=writer)
+                else:
+                    add_person(db_name, driver_name, "driver", race_date, race_track)
+
+            # Update last_played for trainer if available
+            trainer_name = horse_info.get("trainer_name")
+            if trainer_name:
+                trainer_rating = get_person_rating(db_name, trainer_name, "trainer", race_date, cache=cache)
+                if trainer_rating:
+                    update_person_rating(db_name, trainer_name, "trainer", trainer_rating, race_date, race_track, writer=writer)
+                else:
+                    add_person(db_name, trainer_name, "trainer", race_date, race_track)
+
+        writer.flush()
+        return # Stop processing for qualifiers
+
+    # --- Process Regular Race for Rating Updates ---
+    
+    # Store race entries for future reference
+    for horse_info in sorted_horses:
+        horse_name = horse_info["horse_name_lc"]
+        driver_name = horse_info.get("driver_name")
+        trainer_name = horse_info.get("trainer_name")
+        finish_position = str(horse_info["finish"])
+        
+        store_race_entry(
+            db_name, race_date, race_track, race_number,
+            horse_name, driver_name, trainer_name,
+            finish_position, race_class,
+            gait_value, is_qualifier,
+            writer=writer
+        )
+
+    # Prepare ranks for TrueSkill (0-based index)
+    # Handle potential ties if needed, TrueSkill's rate function takes ranks
+    ranks_0_based = [h["finish"] - 1 for h in sorted_horses] # Assumes finish is 1, 2, 3...
+
+    # Process horse ratings
+    # Fetch existing ratings (with decay applied) or create new ones
+    # Pass race_track to fetch_and_decay_rating in case it needs to add the horse
+    decayed_ratings = [fetch_and_decay_rating(db_name, name, race_date, race_track, cache=cache) for name in horse_names]
+
+    # Format for TrueSkill (each horse is a 'team' of one)
+    teams = [(r,) for r in decayed_ratings]
+
+    try:
+        # Array-based analytic update: one vectorized pass over the field
+        # instead of trueskill's per-race factor graph.
+        n = len(decayed_ratings)
+        new_mus, new_sigmas = fast_rate_single_player_teams(
+            np.fromiter((r.mu for r in decayed_ratings), dtype=np.float64, count=n),
+            np.fromiter((r.sigma for r in decayed_ratings), dtype=np.float64, count=n),
+            np.asarray(ranks_0_based, dtype=np.int64))
+        updated_teams = [(trueskill.Rating(mu=float(m), sigma=float(s)),)
+                         for m, s in zip(new_mus, new_sigmas)]
+    except Exception:
+        # scipy missing or a numeric failure: fall back to the factor graph
+        try:
+            updated_teams = trueskill.rate(teams, ranks=ranks_0_based)
+        except Exception as e:
+            logging.error(f"TrueSkill rating failed for Race {race_number} at {race_track}. Error: {e}")
+            writer.flush()  # Keep the already-queued race entries
+            return # Skip updating if rating calculation fails
+
+    # Update database with new ratings and log history.
+    # Per-entity lines accumulate here and go out as a single record at
+    # the end: one handler-lock acquisition per race instead of ~30, and
+    # no formatting at all when INFO is disabled.
+    log_info_enabled = logging.getLogger().isEnabledFor(logging.INFO)
+    log_lines = []
+    if log_info_enabled:
+        log_lines.append(f"--- Processed Race {race_number} ({gait_value.title()}) at {race_track} on {race_date} ---")
+    for horse_info, old_rating_tuple, updated_team in zip(sorted_horses, teams, updated_teams):
+        horse_name = horse_info["horse_name_lc"]
+        new_rating = updated_team[0]
+        old_rating = old_rating_tuple[0] # Get the rating before the update for logging comparison
+
+        # Update player_ratings with new mu, sigma, last_played, last_track
+        update_player_rating(db_name, horse_name, new_rating, race_date, race_track, writer=writer)
+
+        # Log this result to horse_history, passing the track name
+        log_horse_race(
+            db_name,
+            horse_name,
+            new_rating.mu,
+            new_rating.sigma,
+            race_date,
+            race_track,
+            finish_position=str(horse_info.get("finish")),
+            race_class=race_class,
+            writer=writer
+        )
+
+        # Log details
+        if log_info_enabled:
+            log_lines.append("  [%s] %s (Fin: %s) -> Mu: %.2f -> %.2f, Sigma: %.2f -> %.2f"
+                             % (horse_info.get("hn", "?"), # Include HN if available
+                                horse_info['horse_name'],
+                                horse_info['finish'],
+                                old_rating.mu, new_rating.mu,
+                                old_rating.sigma, new_rating.sigma))
+    
+    # Build driver and trainer entities in one pass over the field.
+    # Fusing the three trueskill.rate calls into multi-member teams would
+    # change the inference (team performance is the sum of its members),
+    # so each role keeps its own rate() call on the shared rank vector.
+    driver_entities = []
+    trainer_entities = []
+    # Small fields often share a trainer (or driver); memoize the decayed
+    # rating per (name, kind) so duplicates within the race are one lookup.
+    person_cache: Dict[Tuple[str, str], trueskill.Rating] = {}
+    for horse_info in sorted_horses:
+        rank = horse_info["finish"] - 1  # 0-based for TrueSkill
+
+        driver_name = horse_info.get("driver_name")
+        if driver_name:
+            # Get or create driver rating
+            key = (driver_name, "driver")
+            driver_rating = person_cache.get(key)
+            if driver_rating is None:
+                driver_rating = fetch_and_decay_person_rating(db_name, driver_name, "driver", race_date, race_track, cache=cache)
+                person_cache[key] = driver_rating
+            driver_entities.append({
+                "name": driver_name,
+                "rating": driver_rating,
+                "rank": rank,
+                "horse_name": horse_info["horse_name"]
+            })
+
+        trainer_name = horse_info.get("trainer_name")
+        if trainer_name:
+            # Get or create trainer rating
+            key = (trainer_name, "trainer")
+            trainer_rating = person_cache.get(key)
+            if trainer_rating is None:
+                trainer_rating = fetch_and_decay_person_rating(db_name, trainer_name, "trainer", race_date, race_track, cache=cache)
+                person_cache[key] = trainer_rating
+            trainer_entities.append({
+                "name": trainer_name,
+                "rating": trainer_rating,
+                "rank": rank,
+                "horse_name": horse_info["horse_name"]
+            })
+
+    # Update driver ratings if we have any
+    if driver_entities:
+        # Format for TrueSkill
+        driver_teams = [(r["rating"],) for r in driver_entities]
+        driver_ranks = [r["rank"] for r in driver_entities]
+        
+        try:
+            # Calculate new ratings
+            updated_driver_teams = trueskill.rate(driver_teams, ranks=driver_ranks)
+            
+            # Update database with new ratings and log history
+            for driver_info, updated_team in zip(driver_entities, updated_driver_teams):
+                driver_name = driver_info["name"]
+                new_rating = updated_team[0]
+                old_rating = driver_info["rating"]
+                
+                # Update driver_ratings
+                update_person_rating(db_name, driver_name, "driver", new_rating, race_date, race_track, writer=writer)
+
+                # Log history
+                log_person_race(
+                    db_name, driver_name, "driver", new_rating.mu, new_rating.sigma,
+                    race_date, race_track, driver_info["horse_name"],
+                    str(driver_info["rank"] + 1), race_class,
+                    writer=writer
+                )
+                
+                # Log to console
+                if log_info_enabled:
+                    log_lines.append(f"Driver: {driver_name} (Finish: {driver_info['rank'] + 1}) -> "
+                                     f"Mu: {old_rating.mu:.2f} -> {new_rating.mu:.2f}")
+                
+        except Exception as e:
+            logging.error(f"TrueSkill rating failed for drivers in Race {race_number} at {race_track}. Error: {e}")
+    
+    # Update trainer ratings if we have any
+    if trainer_entities:
+        # Format for TrueSkill
+        trainer_teams = [(r["rating"],) for r in trainer_entities]
+        trainer_ranks = [r["rank"] for r in trainer_entities]
+        
+        try:
+            # Calculate new ratings
+            updated_trainer_teams = trueskill.rate(trainer_teams, ranks=trainer_ranks)
+            
+            # Update database with new ratings and log history
+            for trainer_info, updated_team in zip(trainer_entities, updated_trainer_teams):
+                trainer_name = trainer_info["name"]
+                new_rating = updated_team[0]
+                old_rating = trainer_info["rating"]
+                
+                # Update trainer_ratings
+                update_person_rating(db_name, trainer_name, "trainer", new_rating, race_date, race_track, writer=writer)
+
+                # Log history
+                log_person_race(
+                    db_name, trainer_name, "trainer", new_rating.mu, new_rating.sigma,
+                    race_date, race_track, trainer_info["horse_name"],
+                    str(trainer_info["rank"] + 1), race_class,
+                    writer=writer
+                )
+                
+                # Log to console
+                if log_info_enabled:
+                    log_lines.append(f"Trainer: {trainer_name} (Finish: {trainer_info['rank'] + 1}) -> "
+                                     f"Mu: {old_rating.mu:.2f} -> {new_rating.mu:.2f}")
+                
+        except Exception as e:
+            logging.error(f"TrueSkill rating failed for trainers in Race {race_number} at {race_track}. Error: {e}")
+
+    if log_lines:
+        logging.info("\n".join(log_lines))
+
+    # One transaction for the whole race: entries, rating updates, history.
+    writer.flush()
+
+# -------------------------------------------------------------------------------------
+# Main Script Module
+# -------------------------------------------------------------------------------------
+def main() -> None:
+    global DRY_RUN
+    parser = argparse.ArgumentParser(description="Update horse ratings from race file.")
+    parser.add_argument("--dry-run", action="store_true", help="Run without writing to database")
+    parser.add_argument("--optimize-now", action="store_true",
+                        help="Run ANALYZE and PRAGMA optimize on both databases, then exit")
+    args = parser.parse_args()
+    DRY_RUN = args.dry_run
+    if DRY_RUN:
+        logging.info("Running in DRY RUN mode – no changes will be written to the database.")
+        _install_dry_run_stubs()
+
+    if args.optimize_now:
+        for db_name in ("trotters", "pacers"):
+            conn = get_conn(db_name)
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+        logging.info("Database optimization complete.")
+        return
+
+    # Setup TrueSkill environment
+    # scipy's C-implemented cdf/pdf is orders of magnitude faster than the
+    # 50-digit mpmath arithmetic previously used here, with double precision
+    # being plenty for rating updates.
+    try:
+        trueskill.setup(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA, beta=DEFAULT_SIGMA/2, tau=DEFAULT_SIGMA/100, draw_probability=0.0, backend='scipy')
+        logging.info("Using scipy backend for TrueSkill.")
+    except (ImportError, ValueError):
+        trueskill.setup(mu=DEFAULT_MU, sigma=DEFAULT_SIGMA, beta=DEFAULT_SIGMA/2, tau=DEFAULT_SIGMA/100, draw_probability=0.0)
+        logging.info("scipy not found. Using default backend for TrueSkill.")
+
+
+    # File containing the race results text
+    txt_file = "upload.txt" # Make sure this file exists in the same directory or provide full path
+    if not os.path.exists(txt_file):
+        logging.error(f"Error: Input file '{txt_file}' not found.")
+        return
+
+    # Stream races straight from the memory-mapped file: one race block
+    # is materialized at a time instead of whole-file copies.
+    parsed_count = 0
+    processed_count = 0
+    try:
+        for race in iter_races_from_contents(iter_race_contents(txt_file)):
+            parsed_count += 1
+            # Basic check if race dictionary seems valid before processing
+            if race.get("horses"):
+                try:
+                    process_parsed_race(race)
+                    processed_count += 1
+                except Exception as e:
+                    # Catch potential errors during processing of a single race
+                    logging.error(f"Unhandled error processing Race {race.get('race_number', 'Unknown')} at {race.get('track', 'Unknown')}: {e}", exc_info=True) # Log stack trace
+            else:
+                 logging.warning("Skipping invalid or empty race data block.")
+    except Exception as e:
+        logging.error(f"Error reading file '{txt_file}': {e}")
+        return
+
+    logging.info(f"Parsed {parsed_count} potential races from text.")
+    logging.info(f"Finished processing. Attempted to process {processed_count} races.")
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file